@@ -0,0 +1,80 @@
+"""
+List pages of the admin views in src/admin.py against plain Flask-Admin
+ModelViews of the same models, mounted under /plain on the same app and the
+same data. Reports the median time and the SQL statements of each request.
+
+    $ python benchmarks/seed.py --scale 1m
+    $ python benchmarks/bench_admin.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/starwars_bench.db')
+
+from flask_admin import Admin  # noqa: E402
+from flask_admin.contrib.sqla import ModelView  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from seed import app  # noqa: E402
+from models import db, User, FavoritePlanets  # noqa: E402
+
+TABLES = {'user': User, 'favoriteplanets': FavoritePlanets}
+
+
+def scenarios(table, rows):
+    deep = rows // 20 // 2
+    search = {'user': 'user-4242', 'favoriteplanets': '4242'}[table]
+    return {
+        'first page': ['?page=0'],
+        # the second request of a run is the one timed
+        'next page': ['?page=0', '?page=1'],
+        'deep page': [f'?page={deep}'],
+        'search': [f'?search={search}']
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    plain = Admin(app, name='plain', url='/plain', endpoint='plain', template_mode='bootstrap3')
+    for name, model in TABLES.items():
+        plain.add_view(ModelView(model, db.session, endpoint=f'plain_{name}', url=f'/plain/{name}'))
+
+    statements = []
+    with app.app_context():
+        engines = {db.engine, *(view.session.get_bind() for view in app.extensions['admin'][0]._views if hasattr(view, 'session'))}
+        rows = {name: db.session.execute(db.select(db.func.count()).select_from(model)).scalar()
+                for name, model in TABLES.items()}
+        dialect = db.engine.dialect.name
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(1))
+
+    client = app.test_client()
+    report = {'dialect': dialect, 'rows': rows, 'median_ms': {}}
+    for table in TABLES:
+        for scenario, queries in scenarios(table, rows[table]).items():
+            result = {}
+            for prefix, label in (('/plain', 'plain'), ('/admin', 'indexed')):
+                timings = []
+                for _ in range(args.repeat):
+                    for query in queries:
+                        statements.clear()
+                        start = time.perf_counter()
+                        response = client.get(f'{prefix}/{table}/{query}')
+                        elapsed = time.perf_counter() - start
+                        assert response.status_code == 200, (prefix, table, query, response.status_code)
+                    timings.append(elapsed)
+                result[label] = round(statistics.median(timings) * 1000, 1)
+                result[f'{label}_statements'] = len(statements)
+            result['speedup'] = round(result['plain'] / result['indexed'], 1)
+            report['median_ms'][f'{table} {scenario}'] = result
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Throughput of the sync deployment (gunicorn, sync workers) against the async
+one (uvicorn serving src/asgi.py) at high concurrency, with the same number
+of worker processes and the load driver of load.py. Seed DATABASE_URL with
+seed.py first.
+
+    $ python benchmarks/seed.py --scale 100k
+    $ python benchmarks/bench_async.py --workers 4 --concurrency 128 --duration 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/starwars_bench.db')
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+from load import SRC, DEFAULT_PATHS, run, wait_until_up  # noqa: E402
+
+SERVERS = {
+    'sync_gunicorn': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '--chdir', SRC, '-w', str(workers), '-k', 'sync',
+        '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'
+    ],
+    'async_uvicorn': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', '--app-dir', SRC, '--workers', str(workers),
+        '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning', '--no-access-log', 'asgi:application'
+    ]
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--path', action='append', dest='paths')
+    args = parser.parse_args()
+    paths = tuple(args.paths or DEFAULT_PATHS)
+
+    report = {'workers': args.workers, 'concurrency': args.concurrency, 'duration_s': args.duration}
+    for name, command in SERVERS.items():
+        server = subprocess.Popen(command(args.port, args.workers))
+        try:
+            wait_until_up('127.0.0.1', args.port)
+            report[name] = run(f'http://127.0.0.1:{args.port}', paths, args.concurrency, args.duration, args.warmup)['total']
+        finally:
+            server.terminate()
+            server.wait()
+
+    report['throughput_ratio'] = round(
+        report['async_uvicorn']['throughput_rps'] / report['sync_gunicorn']['throughput_rps'], 2
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Readers and writers on the same SQLite file at the same time, through the
+Flask app, once with the rollback journal the database used to run with and
+once with the WAL pragmas applied by src/database.py. Each mode runs in its
+own process because the engine is configured at import time.
+
+Writers insert batches of planets through POST /planet/bulk while readers
+page through GET /planet. The report shows reader latency and the number of
+requests that failed, e.g. with "database is locked". The script exits with an
+error when the WAL run is not in WAL mode, writes nothing or fails a request.
+
+    $ python benchmarks/bench_concurrency.py --readers 8 --writers 2 --duration 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+DATABASE = '/tmp/bench_concurrency.db'
+MODES = {
+    'rollback_journal': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_BUSY_TIMEOUT_MS': '0'},
+    'wal': {}
+}
+BATCH = 200
+
+
+def percentile(timings, fraction):
+    return round(sorted(timings)[int(len(timings) * fraction) - 1] * 1000, 2) if timings else None
+
+def run_mode(readers, writers, duration):
+    from app import app
+    from models import db, Planet
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(db.insert(Planet), [
+            {'planet_name': f'seed-{i}', 'diameter': i, 'rotation_period': 1, 'orbital_period': 1, 'climate': 'arid'}
+            for i in range(5000)
+        ])
+        db.session.commit()
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    deadline = time.perf_counter() + duration
+    read_timings, write_timings, failures = [], [], {'read': 0, 'write': 0}
+
+    def reader():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = client.get('/planet?limit=200&climate=arid')
+            if response.status_code == 200:
+                read_timings.append(time.perf_counter() - start)
+            else:
+                failures['read'] += 1
+
+    def writer(number):
+        client = app.test_client()
+        batch = 0
+        while time.perf_counter() < deadline:
+            items = [
+                {'planet_name': f'w{number}-{batch}-{i}', 'diameter': i, 'rotation_period': 1,
+                 'orbital_period': 1, 'climate': 'arid'}
+                for i in range(BATCH)
+            ]
+            batch += 1
+            start = time.perf_counter()
+            response = client.post('/planet/bulk', json=items)
+            if response.status_code == 201:
+                write_timings.append(time.perf_counter() - start)
+            else:
+                failures['write'] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(number,)) for number in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'journal_mode': journal_mode,
+        'reads': len(read_timings),
+        'read_p50_ms': percentile(read_timings, 0.5),
+        'read_p99_ms': percentile(read_timings, 0.99),
+        'writes': len(write_timings),
+        'write_p50_ms': percentile(write_timings, 0.5),
+        'failed_reads': failures['read'],
+        'failed_writes': failures['write']
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # child process: the environment already selects the pragmas
+        print(json.dumps(run_mode(args.readers, args.writers, args.duration)))
+        return
+
+    report = {}
+    for mode, overrides in MODES.items():
+        for path in (DATABASE, DATABASE + '-wal', DATABASE + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{DATABASE}', **overrides)
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--readers', str(args.readers),
+             '--writers', str(args.writers), '--duration', str(args.duration)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        report[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(json.dumps(dict({'readers': args.readers, 'writers': args.writers, 'duration_s': args.duration}, **report), indent=2))
+    wal = report['wal']
+    if wal['journal_mode'] != 'wal' or not wal['writes'] or wal['failed_reads'] or wal['failed_writes']:
+        sys.exit('the WAL run must be in WAL mode, write and fail no request')
+
+
+if __name__ == '__main__':
+    main()
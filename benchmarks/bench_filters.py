@@ -0,0 +1,84 @@
+"""
+Times filtered and sorted list requests on a large planet table and prints the
+SQLite plan of each query, to check that the composite indexes are used.
+
+    $ python benchmarks/bench_filters.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/bench_filters.db')
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+from sqlalchemy import event  # noqa: E402
+from app import app  # noqa: E402
+from models import db, Planet  # noqa: E402
+
+CLIMATES = ('arid', 'temperate', 'frozen', 'murky', 'tropical', 'windy', 'humid', 'superheated')
+URLS = [
+    '/planet?climate=frozen&limit=50',
+    '/planet?climate=frozen&diameter__gte=5000&diameter__lt=6000&limit=50',
+    '/planet?climate__in=arid,windy&diameter__gte=12000&limit=50',
+    '/planet?diameter__gte=9990&sort=-diameter&limit=50',
+    '/planet?climate=murky&sort=-diameter,planet_name&limit=50',
+]
+BATCH = 50000
+
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    for start in range(0, rows, BATCH):
+        db.session.execute(db.insert(Planet), [
+            {'planet_name': f'planet-{i}', 'diameter': (i * 7919) % 13000, 'rotation_period': i % 50,
+             'orbital_period': i % 400, 'climate': CLIMATES[i % len(CLIMATES)]}
+            for i in range(start, min(start + BATCH, rows))
+        ])
+        db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-seed', action='store_true')
+    args = parser.parse_args()
+
+    client = app.test_client()
+    statements = []
+    with app.app_context():
+        if not args.no_seed:
+            seed(args.rows)
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, parameters, *rest: statements.append((statement, parameters)))
+
+    report = []
+    for url in URLS:
+        timings = []
+        for _ in range(args.repeat):
+            statements.clear()
+            start = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.json
+        statement, parameters = next(item for item in statements if 'ORDER BY' in item[0])
+        with app.app_context():
+            plan = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+        report.append({
+            'url': url,
+            'rows_returned': len(response.json['data']),
+            'median_ms': round(statistics.median(timings) * 1000, 2),
+            'plan': [row[-1] for row in plan]
+        })
+
+    print(json.dumps({'rows': args.rows, 'results': report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Throughput and peak memory of `flask catalog import` and `export`. Writes
+SCALE planets, characters and vehicles with the generators of seed.py to
+NDJSON and CSV files, imports each file into an empty schema and exports the
+tables back.
+
+    $ python benchmarks/bench_import.py --scale 1m
+    $ DATABASE_URL=postgresql://localhost/starwars_bench python benchmarks/bench_import.py --scale 1m
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/starwars_bench.db')
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+from seed import SCALES, planets, characters, vehicles  # noqa: E402
+from app import app  # noqa: E402
+from models import db  # noqa: E402
+from transfer import import_file, export_file  # noqa: E402
+
+GENERATORS = {'planet': planets, 'character': characters, 'vehicle': vehicles}
+
+
+def write_source(kind, scale, fmt, directory):
+    """The generated rows without their ids, as the import file"""
+    path = os.path.join(directory, f'{kind}.{fmt}')
+    rows = GENERATORS[kind](random.Random(42), scale)
+    with open(path, 'w', newline='') as handle:
+        if fmt == 'csv':
+            writer = None
+            for row in rows:
+                row.pop(f'{kind}_id')
+                if writer is None:
+                    writer = csv.DictWriter(handle, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+        else:
+            for row in rows:
+                row.pop(f'{kind}_id')
+                handle.write(json.dumps(row) + '\n')
+    return path
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    rows = fn(*args)
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': round(seconds, 2), 'rows_per_s': round(rows / seconds)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', default='100k', help='1k, 100k, 1m or a row count')
+    parser.add_argument('--format', dest='fmt', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--chunk', type=int, default=10000)
+    args = parser.parse_args()
+    scale = SCALES.get(args.scale.lower()) or int(args.scale)
+
+    report = {'scale': scale, 'format': args.fmt, 'chunk': args.chunk}
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        db.drop_all()
+        db.create_all()
+        report['dialect'] = db.engine.dialect.name
+        for kind in GENERATORS:
+            path = write_source(kind, scale, args.fmt, directory)
+            report[kind] = {
+                'file_mb': round(os.path.getsize(path) / 2 ** 20, 1),
+                'import': timed(import_file, kind, path, args.fmt, args.chunk),
+                'export': timed(export_file, kind, os.path.join(directory, f'out.{args.fmt}'), args.fmt, args.chunk)
+            }
+    # ru_maxrss is in kilobytes on Linux
+    report['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
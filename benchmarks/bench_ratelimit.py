@@ -0,0 +1,170 @@
+"""
+Latency of well-behaved clients while one client floods the API. Gunicorn
+serves a catalog with the rate limits on a shared mmap backend. --clients
+threads, each its own client through the X-Client-Id header, send
+--good-rate requests a second, well under their limits, while one abusive
+client sends --abuser-rate list requests a second, many times its limit and
+more than the workers can answer, over --abusers connections from its own
+process. Every client keeps to its schedule whatever it gets back, none of
+them backs off after a 429. The runs:
+
+    baseline        only the well-behaved clients
+    floor           the same flood on a URL that does not exist, what the
+                    connections alone cost the host with nothing to limit
+    unlimited       with the abuser, RATELIMIT_ENABLED=0
+    limited         with the abuser, the limits on
+
+The report has the latencies of the well-behaved clients and the statuses
+each side got in every run. A rejection costs about as much as a 404, so the
+limited run can only get as close to the baseline as the floor.
+
+    $ python benchmarks/bench_ratelimit.py --clients 8 --abuser-rate 200 --duration 10
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+DATABASE = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE}'
+
+from load import start_gunicorn, percentiles  # noqa: E402
+
+GOOD_PATHS = ('/planet?limit=50', '/planet/{}', '/search?q=planet-{}&limit=10')
+ABUSER_PATH = '/planet?limit=100'
+RUNS = {
+    'baseline': (True, None),
+    'floor': (True, '/nothing-here'),
+    'unlimited': (False, ABUSER_PATH),
+    'limited': (True, ABUSER_PATH)
+}
+PLANETS = 2000
+
+
+def seed():
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+    from app import app
+    from models import db, Planet
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(Planet), [
+            {'planet_name': f'planet-{i}', 'diameter': i, 'rotation_period': 24, 'orbital_period': 365, 'climate': 'arid'}
+            for i in range(PLANETS)
+        ])
+        db.session.commit()
+
+def send(connection, path, name):
+    start = time.perf_counter()
+    try:
+        connection.request('GET', path, headers={'X-Client-Id': name})
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        connection.close()
+        status = 'error'
+    return status, time.perf_counter() - start
+
+def client(port, name, paths, rate, start, deadline, results):
+    """Sends on a fixed schedule, so slow answers do not lower the load it offers"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    next_at = start
+    sent = 0
+    while next_at < deadline:
+        time.sleep(max(0, next_at - time.perf_counter()))
+        results.append(send(connection, paths[sent % len(paths)], name))
+        sent += 1
+        next_at += 1 / rate
+    connection.close()
+
+def statuses(results):
+    counts = {}
+    for status, _ in results:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return counts
+
+def abuser(port, path, connections, rate, duration, queue):
+    """Runs in its own process, so its threads do not delay the measured clients"""
+    results = []
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(port, 'abuser', [path], rate / connections,
+                                                     start + index / rate, start + duration, results))
+               for index in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put(statuses(results))
+
+def run(args, enabled, flood):
+    env = dict(os.environ, RATELIMIT_ENABLED=str(int(enabled)), RATELIMIT_BACKEND='mmap',
+               RATELIMIT_MMAP_PATH=DATABASE + '.ratelimit', RATELIMIT_CLIENT_HEADER='X-Client-Id')
+    server = start_gunicorn('127.0.0.1', args.port, args.workers, env)
+    try:
+        queue = multiprocessing.Queue()
+        if flood:
+            process = multiprocessing.Process(target=abuser, args=(
+                args.port, flood, args.abusers, args.abuser_rate, args.duration, queue
+            ))
+            process.start()
+        good = []
+        start = time.perf_counter()
+        threads = []
+        for index in range(args.clients):
+            paths = [path.format((index * 97 + sent) % PLANETS + 1) for sent, path in enumerate(GOOD_PATHS * 10)]
+            threads.append(threading.Thread(target=client, args=(
+                args.port, f'client-{index}', paths, args.good_rate,
+                start + index / args.clients / args.good_rate, start + args.duration, good
+            )))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report = {'good': dict(statuses=statuses(good), **percentiles([seconds for _, seconds in good]))}
+        if flood:
+            report['abuser'] = {'statuses': queue.get()}
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=8, help='well-behaved clients')
+    parser.add_argument('--good-rate', type=float, default=5, help='requests a second of each well-behaved client')
+    parser.add_argument('--abuser-rate', type=float, default=200, help='requests a second of the abusive client')
+    parser.add_argument('--abusers', type=int, default=16, help='connections of the abusive client')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    seed()
+    try:
+        report = {
+            'clients': args.clients,
+            'good_rate': args.good_rate,
+            'abuser_rate': args.abuser_rate,
+            'workers': args.workers,
+            **{name: run(args, enabled, flood) for name, (enabled, flood) in RUNS.items()}
+        }
+    finally:
+        for path in (DATABASE, DATABASE + '-wal', DATABASE + '-shm', DATABASE + '.ratelimit'):
+            if os.path.exists(path):
+                os.remove(path)
+    report['p99_vs_baseline'] = {
+        name: round(report[name]['good']['p99_ms'] / report['baseline']['good']['p99_ms'], 1)
+        for name in ('floor', 'unlimited', 'limited')
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
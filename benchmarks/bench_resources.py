@@ -0,0 +1,116 @@
+"""
+Per request cost of the generated catalog routes (src/resources.py) against
+the hand written handlers they replaced, and a check that both answer with the
+same status and body. The tree at --baseline is exported with git archive and
+both trees replay the same requests through the Flask test client, each in its
+own process and on its own empty SQLite database.
+
+    $ python benchmarks/bench_resources.py --requests 300
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BODIES = {
+    'planet': lambda i: {'planet_name': f'bench-{i}', 'diameter': i, 'rotation_period': 24,
+                         'orbital_period': 365, 'climate': 'temperate'},
+    'character': lambda i: {'character_name': f'bench-{i}', 'skin_color': 'fair', 'hair_color': 'blond',
+                            'gender': 'male', 'age': i},
+    'vehicle': lambda i: {'vehicle_name': f'bench-{i}', 'passengers': i, 'load_capacity': 100,
+                          'armament': 'none', 'length': 10}
+}
+
+
+def script(requests):
+    """(label, method, path, json body) of every request, in order"""
+    steps = []
+    for kind, body in BODIES.items():
+        name = f'{kind}_name'
+        for i in range(1, requests + 1):
+            steps.append(('POST valid', 'POST', f'/{kind}', body(i)))
+        for i in range(1, requests + 1):
+            steps.append(('GET single', 'GET', f'/{kind}/{i}', None))
+            steps.append(('PUT valid', 'PUT', f'/{kind}/{i}', {name: f'renamed-{i}'}))
+            steps.append(('POST missing field', 'POST', f'/{kind}', {name: f'other-{i}'}))
+            steps.append(('POST unknown field', 'POST', f'/{kind}', dict(body(i), color='red')))
+            steps.append(('PUT unknown field', 'PUT', f'/{kind}/{i}', {'color': 'red'}))
+            steps.append(('POST existing name', 'POST', f'/{kind}', dict(body(i), **{name: f'renamed-{i}'})))
+        steps.append(('GET list', 'GET', f'/{kind}?limit=20', None))
+        steps.append(('GET missing', 'GET', f'/{kind}/{requests + 1}', None))
+        for i in range(1, requests + 1):
+            steps.append(('DELETE', 'DELETE', f'/{kind}/{i}', None))
+    return steps
+
+def drive(src, requests, out):
+    """Runs in the child process: replays the script against the app in `src`"""
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ['RATELIMIT_ENABLED'] = '0'
+    sys.path.insert(0, src)
+    from app import app
+    from models import db
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+
+    responses = []
+    timings = {}
+    for label, method, path, body in script(requests):
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        timings.setdefault(label, []).append(time.perf_counter() - start)
+        responses.append([label, method, path, response.status_code, response.get_json()])
+    os.remove(database)
+    with open(out, 'w') as handle:
+        json.dump({'responses': responses, 'timings': timings}, handle)
+
+def run_tree(src, requests):
+    with tempfile.NamedTemporaryFile(suffix='.json') as out:
+        subprocess.run([sys.executable, __file__, '--driver', src, '--requests', str(requests), '--out', out.name], check=True)
+        return json.load(open(out.name))
+
+def default_baseline():
+    # the commit before the one that added src/resources.py
+    added = subprocess.run(['git', '-C', ROOT, 'log', '--diff-filter=A', '--format=%H', '--', 'src/resources.py'],
+                           capture_output=True, text=True, check=True).stdout.split()
+    return f'{added[-1]}~1' if added else 'HEAD'
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=300, help='entities created per kind')
+    parser.add_argument('--baseline', help='git revision with the hand written handlers')
+    parser.add_argument('--driver')
+    parser.add_argument('--out')
+    args = parser.parse_args()
+    if args.driver:
+        return drive(args.driver, args.requests, args.out)
+
+    baseline = args.baseline or default_baseline()
+    with tempfile.TemporaryDirectory() as directory:
+        archive = subprocess.run(['git', '-C', ROOT, 'archive', baseline, 'src'], capture_output=True, check=True).stdout
+        subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+        before = run_tree(os.path.join(directory, 'src'), args.requests)
+    after = run_tree(os.path.join(ROOT, 'src'), args.requests)
+
+    different = [
+        {'request': old[:3], 'baseline': old[3:], 'generated': new[3:]}
+        for old, new in zip(before['responses'], after['responses']) if old != new
+    ]
+    report = {'baseline': baseline, 'requests': len(after['responses']), 'median_us': {}}
+    for label in after['timings']:
+        old = statistics.median(before['timings'][label]) * 1e6
+        new = statistics.median(after['timings'][label]) * 1e6
+        report['median_us'][label] = {'baseline': round(old), 'generated': round(new), 'ratio': round(new / old, 2)}
+    report['identical_responses'] = len(after['responses']) - len(different)
+    report['different_responses'] = different[:10]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
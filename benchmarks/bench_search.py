@@ -0,0 +1,66 @@
+"""
+Latency of the in-memory prefix index used by GET /search.
+
+    $ python benchmarks/bench_search.py --names 1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from search import PrefixIndex  # noqa: E402
+
+SYLLABLES = ['sky', 'wal', 'ker', 'tat', 'oo', 'ine', 'hoth', 'end', 'or', 'na', 'boo', 'dag', 'bah', 'kash', 'yyy', 'ben']
+KINDS = ('planet', 'character', 'vehicle')
+
+
+def percentile(timings, fraction):
+    return sorted(timings)[int(len(timings) * fraction) - 1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--names', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    entries = [
+        (KINDS[i % 3], i, ''.join(rng.choice(SYLLABLES) for _ in range(3)).capitalize() + f' {i}')
+        for i in range(args.names)
+    ]
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.build(entries)
+    build_seconds = time.perf_counter() - start
+
+    timings = []
+    for _ in range(args.queries):
+        prefix = rng.choice(SYLLABLES) + rng.choice(SYLLABLES)[:rng.randint(0, 2)]
+        start = time.perf_counter()
+        index.search(prefix, set(KINDS), 10)
+        timings.append(time.perf_counter() - start)
+
+    writes = []
+    for i in range(1000):
+        start = time.perf_counter()
+        index.add('planet', args.names + i, f'Skyward {i}')
+        index.remove('planet', args.names + i)
+        writes.append(time.perf_counter() - start)
+
+    print(json.dumps({
+        'names': args.names,
+        'build_s': round(build_seconds, 2),
+        'search_p50_ms': round(statistics.median(timings) * 1000, 4),
+        'search_p99_ms': round(percentile(timings, 0.99) * 1000, 4),
+        'add_remove_p99_ms': round(percentile(writes, 0.99) * 1000, 4)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
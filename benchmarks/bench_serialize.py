@@ -0,0 +1,71 @@
+"""
+Compares the list serialization paths on 10k planets:
+ORM instances + serialize() + stdlib json against
+select(columns) + row_serializer() + the app JSON provider.
+
+    $ python benchmarks/bench_serialize.py --rows 10000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+from app import app  # noqa: E402
+from models import db, Planet, row_serializer  # noqa: E402
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(db.insert(Planet), [
+        {'planet_name': f'planet-{i}', 'diameter': i, 'rotation_period': i % 50,
+         'orbital_period': i % 400, 'climate': 'temperate'}
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+def orm_path():
+    db.session.expunge_all()
+    return json.dumps(list(map(Planet.serialize, Planet.query.all())))
+
+def row_path():
+    serialize = row_serializer(Planet)
+    rows = db.session.execute(db.select(*[getattr(Planet, field) for field in Planet.public_fields])).all()
+    return app.json.dumps([serialize(row) for row in rows])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.rows)
+        assert json.loads(orm_path()) == json.loads(row_path())
+        orm = best_of(args.repeat, orm_path)
+        rows = best_of(args.repeat, row_path)
+
+    print(json.dumps({
+        'rows': args.rows,
+        'json_provider': type(app.json).__name__,
+        'orm_serialize_ms': round(orm * 1000, 2),
+        'row_serializer_ms': round(rows * 1000, 2),
+        'speedup': round(orm / rows, 2)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Read latency during a signup burst. A gunicorn server with threaded workers
+is loaded with concurrent POST /user requests, each hashing a password, while
+load.py measures GET latency on catalog routes; the same reads are measured
+without the burst as a baseline. It runs once with the bounded password pool
+and once with a pool as large as the burst, to show what the bound buys.
+
+    $ python benchmarks/seed.py --scale 1k
+    $ python benchmarks/bench_signup.py --signups 16 --duration 10
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(__file__))
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/starwars_bench.db')
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+from load import SRC, run, wait_until_up  # noqa: E402
+
+READ_PATHS = ('/planet/500', '/character?limit=20', '/vehicle/200')
+
+
+def signup_burst(port, clients, deadline, results):
+    def signup():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while time.perf_counter() < deadline:
+            name = uuid.uuid4().hex[:20]
+            body = json.dumps({'user_name': name, 'email': f'{name}@example.com',
+                               'password': 'correct horse battery staple', 'is_active': True})
+            start = time.perf_counter()
+            connection.request('POST', '/user', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            results.append((response.status, time.perf_counter() - start))
+        connection.close()
+
+    threads = [threading.Thread(target=signup) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def measure(port, args, pool_workers):
+    env = dict(os.environ, PASSWORD_WORKERS=str(pool_workers))
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '--chdir', SRC, '-w', str(args.workers), '-k', 'gthread',
+        '--threads', str(args.threads), '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'
+    ], env=env)
+    try:
+        wait_until_up('127.0.0.1', port)
+        url = f'http://127.0.0.1:{port}'
+        baseline = run(url, READ_PATHS, args.readers, args.duration, 1)['total']
+
+        signups = []
+        threads = signup_burst(port, args.signups, time.perf_counter() + args.duration + 1, signups)
+        burst = run(url, READ_PATHS, args.readers, args.duration, 1)['total']
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    statuses = {}
+    for status, _ in signups:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    timings = sorted(seconds for status, seconds in signups if status == 201)
+    return {
+        'password_workers': pool_workers,
+        'reads_baseline': baseline,
+        'reads_during_signups': burst,
+        'signups': {
+            'statuses': statuses,
+            'p50_ms': round(timings[len(timings) // 2] * 1000, 1) if timings else None
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--signups', type=int, default=16)
+    parser.add_argument('--pool', type=int, default=1, help='PASSWORD_WORKERS of the bounded run')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'bounded': measure(args.port, args, args.pool),
+        'unbounded': measure(args.port, args, args.signups)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Startup cost of every app profile, as a fresh gunicorn worker (without
+preload) or a test run pays it: interpreter start, `import app`,
+create_app() and the first request. Each run is a new process and the
+report has the median of --runs runs per profile.
+
+Exits with status 1 when a median boot (import plus create_app) is over
+--max-ms, or more than --tolerance slower than the same profile in a
+--baseline report saved earlier with --output:
+
+    $ python benchmarks/bench_startup.py --output startup.json
+    $ python benchmarks/bench_startup.py --baseline startup.json --tolerance 0.2
+    $ python benchmarks/bench_startup.py --profile api --max-ms 700
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+PROFILES = ('full', 'api')
+METRICS = ('process_ms', 'import_ms', 'create_ms', 'first_request_ms', 'boot_ms')
+
+
+def child(profile):
+    """Runs in the measured process, prints its timings as JSON"""
+    os.environ['APP_PROFILE'] = profile
+    sys.path.insert(0, SRC)
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    application = app.create_app()
+    created = time.perf_counter()
+    application.test_client().get('/cache/stats')
+    answered = time.perf_counter()
+    print(json.dumps({
+        'import_ms': (imported - start) * 1000,
+        'create_ms': (created - imported) * 1000,
+        'first_request_ms': (answered - created) * 1000,
+        'modules': len(sys.modules)
+    }))
+
+def run_once(profile, database):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, __file__, '--child', profile], env=env,
+                            capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.splitlines()[-1])
+    timings['process_ms'] = (time.perf_counter() - start) * 1000
+    timings['boot_ms'] = timings['import_ms'] + timings['create_ms']
+    return timings
+
+def measure(profile, runs, database):
+    # one unmeasured run so every profile starts with the same warm page cache
+    run_once(profile, database)
+    samples = [run_once(profile, database) for _ in range(runs)]
+    report = {metric: round(statistics.median(sample[metric] for sample in samples), 1) for metric in METRICS}
+    report['modules'] = samples[-1]['modules']
+    return report
+
+def regressions(report, baseline, tolerance, max_ms):
+    found = []
+    for profile, timings in report['profiles'].items():
+        if max_ms is not None and timings['boot_ms'] > max_ms:
+            found.append(f'{profile}: boot {timings["boot_ms"]} ms is over {max_ms} ms')
+        before = (baseline or {}).get('profiles', {}).get(profile)
+        if before and timings['boot_ms'] > before['boot_ms'] * (1 + tolerance):
+            found.append(f'{profile}: boot {timings["boot_ms"]} ms, was {before["boot_ms"]} ms in the baseline')
+    return found
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', choices=PROFILES, action='append', help='defaults to every profile')
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--max-ms', type=float, help='highest median boot allowed for any profile')
+    parser.add_argument('--baseline', help='report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown allowed against the baseline')
+    parser.add_argument('--output', help='also write the report to this file')
+    parser.add_argument('--child')
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    with tempfile.NamedTemporaryFile(suffix='.db') as database:
+        report = {
+            'python': sys.version.split()[0],
+            'runs': args.runs,
+            'profiles': {profile: measure(profile, args.runs, database.name) for profile in args.profile or PROFILES}
+        }
+    if 'full' in report['profiles'] and 'api' in report['profiles']:
+        report['api_vs_full_boot'] = round(report['profiles']['api']['boot_ms'] / report['profiles']['full']['boot_ms'], 2)
+
+    baseline = json.load(open(args.baseline)) if args.baseline else None
+    report['regressions'] = regressions(report, baseline, args.tolerance, args.max_ms)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    if report['regressions']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Prints the SQLite query plans of the favorite lookups with and without the
+(user_id, entity_id) unique indexes, and exits with an error when a lookup
+no longer searches its unique index.
+
+    $ python benchmarks/explain_favorites.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import app  # noqa: E402
+from models import db, FavoritePlanets, FavoriteCharacters, FavoriteVehicles  # noqa: E402
+
+QUERIES = [
+    'SELECT * FROM {table} WHERE user_id = 1',
+    'SELECT id FROM {table} WHERE user_id = 1 AND {column} = 1',
+]
+
+
+def unique_index(model):
+    return next(index.name for index in model.__table__.indexes if index.unique)
+
+def plans():
+    """{sql: (plan, name of the unique index it should search)}"""
+    result = {}
+    for model in (FavoritePlanets, FavoriteCharacters, FavoriteVehicles):
+        column = [c.name for c in model.__table__.columns if c.name not in ('id', 'user_id')][0]
+        for query in QUERIES:
+            sql = query.format(table=model.__tablename__, column=column)
+            rows = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}')).all()
+            result[sql] = (' / '.join(row[-1] for row in rows), unique_index(model))
+    return result
+
+def main():
+    with app.app_context():
+        db.create_all()
+        indexes = [index for model in (FavoritePlanets, FavoriteCharacters, FavoriteVehicles)
+                   for index in model.__table__.indexes]
+        for index in indexes:
+            index.drop(db.engine)
+        before = plans()
+        for index in indexes:
+            index.create(db.engine)
+        after = plans()
+
+    missed = []
+    for sql, (plan, index) in after.items():
+        print(sql)
+        print(f'  before: {before[sql][0]}')
+        print(f'  after:  {plan}')
+        if not plan.startswith('SEARCH') or f'INDEX {index} ' not in plan:
+            missed.append(f'{sql} does not search {index}')
+    if missed:
+        sys.exit('\n'.join(missed))
+
+
+if __name__ == '__main__':
+    main()
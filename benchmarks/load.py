@@ -0,0 +1,174 @@
+"""
+Concurrent HTTP load driver. Each thread keeps one keep-alive connection and
+requests the paths round robin for --duration seconds; the report has the
+throughput and p50/p95/p99 latencies overall and per path, as JSON, so runs
+can be stored and compared.
+
+Against a running server:
+
+    $ gunicorn --chdir src -w 4 -b 127.0.0.1:8000 app:app
+    $ python benchmarks/load.py --url http://127.0.0.1:8000 --concurrency 32
+
+Or let the driver start gunicorn on the current DATABASE_URL (seed it first
+with seed.py) and stop it afterwards:
+
+    $ python benchmarks/load.py --gunicorn-workers 4 --output run.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+DEFAULT_PATHS = (
+    '/planet?limit=100',
+    '/planet/500',
+    '/character?gender=female&limit=100',
+    '/vehicle/500',
+    '/user/500/favorites',
+    '/search?q=planet-12&limit=10',
+)
+
+
+def percentiles(timings):
+    if not timings:
+        return {}
+    if len(timings) == 1:
+        return {name: round(timings[0] * 1000, 3) for name in ('p50_ms', 'p95_ms', 'p99_ms')}
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3)
+    }
+
+def worker(host, port, paths, offset, deadline, results):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    index = offset
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            status = 'error'
+        results.append((path, status, time.perf_counter() - start))
+    connection.close()
+
+def wait_until_up(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=1)
+            connection.request('GET', '/cache/stats')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'server on {host}:{port} did not start')
+
+def start_gunicorn(host, port, workers, env=None):
+    command = [sys.executable, '-m', 'gunicorn', '--chdir', SRC, '-w', str(workers),
+               '-b', f'{host}:{port}', '--log-level', 'warning', 'app:app']
+    env = dict(os.environ if env is None else env)
+    # all the load comes from one address, the rate limits would measure themselves
+    env.setdefault('RATELIMIT_ENABLED', '0')
+    process = subprocess.Popen(command, env=env)
+    wait_until_up(host, port)
+    return process
+
+def run(url, paths, concurrency, duration, warmup):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    if warmup:
+        run_threads(host, port, paths, concurrency, warmup)
+    results, elapsed = run_threads(host, port, paths, concurrency, duration)
+
+    report = {
+        'total': dict(
+            requests=len(results),
+            errors=sum(1 for _, status, _ in results if status == 'error' or status >= 500),
+            throughput_rps=round(len(results) / elapsed, 1),
+            **percentiles([seconds for _, _, seconds in results])
+        ),
+        'paths': {}
+    }
+    for path in paths:
+        timings = [seconds for result_path, _, seconds in results if result_path == path]
+        statuses = {}
+        for result_path, status, _ in results:
+            if result_path == path:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        report['paths'][path] = dict(requests=len(timings), statuses=statuses,
+                                     throughput_rps=round(len(timings) / elapsed, 1), **percentiles(timings))
+    return report
+
+def run_threads(host, port, paths, concurrency, duration):
+    results = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=worker, args=(host, port, paths, offset, deadline, results))
+        for offset in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--path', action='append', dest='paths', help='repeatable, defaults to a mix of reads')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--gunicorn-workers', type=int, help='start gunicorn with this many workers')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+    paths = tuple(args.paths or DEFAULT_PATHS)
+
+    server = None
+    if args.gunicorn_workers:
+        parts = urlsplit(args.url)
+        server = start_gunicorn(parts.hostname, parts.port or 80, args.gunicorn_workers)
+    try:
+        report = run(args.url, paths, args.concurrency, args.duration, args.warmup)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = dict({
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'gunicorn_workers': args.gunicorn_workers,
+        'database': os.getenv('DATABASE_URL', '').split('@')[-1],
+        'python': platform.python_version(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }, **report)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Micro-benchmarks of each model serialize() and of every read route through
+the Flask test client, on data generated by seed.py. Prints one JSON report
+with the per-call median and p95 in microseconds.
+
+    $ python benchmarks/micro.py --scale 1k --repeat 200
+    $ python benchmarks/micro.py --no-seed --output before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from seed import app, seed, SCALES  # noqa: E402
+from models import db, User, Planet, Character, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles  # noqa: E402
+
+MODELS = (User, Planet, Character, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles)
+ROUTES = (
+    '/user?limit=100',
+    '/user/{id}',
+    '/planet?limit=100',
+    '/planet/{id}',
+    '/planet?climate=arid&diameter__gte=5000&limit=100',
+    '/character?limit=100',
+    '/character/{id}',
+    '/character?gender=female&sort=-age&limit=100',
+    '/vehicle?limit=100',
+    '/vehicle/{id}',
+    '/user/{id}/favorites',
+    '/search?q=planet-1&limit=10',
+)
+
+
+def summary(timings):
+    timings = sorted(timings)
+    return {
+        'median_us': round(statistics.median(timings) * 1e6, 1),
+        'p95_us': round(timings[int(len(timings) * 0.95) - 1] * 1e6, 1),
+        'calls': len(timings)
+    }
+
+def bench_serialize(repeat):
+    report = {}
+    for model in MODELS:
+        instances = db.session.execute(db.select(model).limit(100)).scalars().all()
+        # touch the relationships so only serialize() itself is timed
+        for instance in instances:
+            instance.serialize()
+        timings = []
+        for _ in range(repeat):
+            for instance in instances:
+                start = time.perf_counter()
+                instance.serialize()
+                timings.append(time.perf_counter() - start)
+        report[f'{model.__name__}.serialize'] = summary(timings)
+    return report
+
+def bench_routes(client, repeat, entity_id):
+    report = {}
+    for route in ROUTES:
+        url = route.format(id=entity_id)
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            client.get(url)
+            timings.append(time.perf_counter() - start)
+        report[f'GET {route}'] = dict(summary(timings), bytes=len(response.data))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', default='1k', help='1k, 100k, 1m or a row count')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--no-seed', action='store_true', help='reuse the rows already in DATABASE_URL')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+    scale = SCALES.get(args.scale.lower()) or int(args.scale)
+
+    with app.app_context():
+        if not args.no_seed:
+            seed(scale)
+        entity_id = db.session.execute(db.select(db.func.max(Planet.planet_id))).scalar() // 2 or 1
+        report = {
+            'dialect': db.engine.dialect.name,
+            'rows': db.session.execute(db.select(db.func.count()).select_from(Planet)).scalar(),
+            'json_provider': type(app.json).__name__,
+            'serialize': bench_serialize(args.repeat)
+        }
+        db.session.remove()
+    report['routes'] = bench_routes(app.test_client(), args.repeat, entity_id)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Deterministic data generator for the benchmarks: SCALE users, planets,
+characters and vehicles, and FAVORITES favorites of each kind per user.
+The same --scale and --seed always produce the same rows, on SQLite or
+Postgres.
+
+    $ python benchmarks/seed.py --scale 100000
+    $ DATABASE_URL=postgresql://localhost/starwars_bench python benchmarks/seed.py --scale 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/starwars_bench.db')
+os.environ.setdefault('RATELIMIT_ENABLED', '0')
+
+from app import app  # noqa: E402
+from favorites import FAVORITE_KINDS, reconcile_counts  # noqa: E402
+from models import db, User, Planet, Character, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles  # noqa: E402
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+BATCH = 20000
+CLIMATES = ('arid', 'temperate', 'frozen', 'murky', 'tropical', 'windy', 'humid', 'superheated')
+COLORS = ('blond', 'brown', 'black', 'white', 'red', 'fair', 'gold', 'green', 'blue', 'grey')
+GENDERS = ('male', 'female', 'n/a', 'hermaphrodite')
+ARMAMENTS = ('none', 'blaster cannon', 'laser cannon', 'ion cannon', 'proton torpedoes')
+
+
+def users(rng, scale):
+    for i in range(1, scale + 1):
+        yield {'id': i, 'user_name': f'user-{i}', 'email': f'user-{i}@example.com',
+               'password': 'benchmark', 'is_active': rng.random() > 0.1}
+
+def planets(rng, scale):
+    for i in range(1, scale + 1):
+        yield {'planet_id': i, 'planet_name': f'planet-{i}', 'diameter': rng.randint(0, 13000),
+               'rotation_period': rng.randint(0, 50), 'orbital_period': rng.randint(0, 400),
+               'climate': rng.choice(CLIMATES)}
+
+def characters(rng, scale):
+    for i in range(1, scale + 1):
+        yield {'character_id': i, 'character_name': f'character-{i}', 'skin_color': rng.choice(COLORS),
+               'hair_color': rng.choice(COLORS), 'gender': rng.choice(GENDERS), 'age': rng.randint(0, 900)}
+
+def vehicles(rng, scale):
+    for i in range(1, scale + 1):
+        yield {'vehicle_id': i, 'vehicle_name': f'vehicle-{i}', 'passengers': rng.randint(0, 500),
+               'load_capacity': rng.randint(0, 100000), 'armament': rng.choice(ARMAMENTS),
+               'length': rng.randint(1, 2000)}
+
+def favorites(column, scale, per_user, offset):
+    # distinct entities per user because 104729 is prime and per_user < scale
+    for user_id in range(1, scale + 1):
+        for k in range(per_user):
+            yield {'user_id': user_id, column: (user_id * 7919 + k * 104729 + offset) % scale + 1}
+
+def insert_all(model, rows):
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            db.session.execute(db.insert(model), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+        count += len(batch)
+    db.session.commit()
+    return count
+
+def seed(scale, per_user=3, seed_value=42):
+    """Recreates the schema and fills it. Returns the row count per table."""
+    rng = random.Random(seed_value)
+    per_user = min(per_user, scale - 1)
+    db.drop_all()
+    db.create_all()
+    counts = {
+        'user': insert_all(User, users(rng, scale)),
+        'planet': insert_all(Planet, planets(rng, scale)),
+        'character': insert_all(Character, characters(rng, scale)),
+        'vehicle': insert_all(Vehicle, vehicles(rng, scale)),
+        'favorite_planets': insert_all(FavoritePlanets, favorites('planet_id', scale, per_user, 0)),
+        'favorite_characters': insert_all(FavoriteCharacters, favorites('character_id', scale, per_user, 1)),
+        'favorite_vehicles': insert_all(FavoriteVehicles, favorites('vehicle_id', scale, per_user, 2)),
+    }
+    if db.engine.dialect.name == 'postgresql':
+        # Postgres sequences do not move when ids are inserted explicitly
+        for model, pk in ((User, 'id'), (Planet, 'planet_id'), (Character, 'character_id'), (Vehicle, 'vehicle_id')):
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('\"{model.__tablename__}\"', '{pk}'), {scale})"
+            ))
+    for kind in FAVORITE_KINDS:
+        reconcile_counts(kind, batch=BATCH * 5)
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', default='1k', help='1k, 100k, 1m or a row count')
+    parser.add_argument('--favorites', type=int, default=3, help='favorites of each kind per user')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    scale = SCALES.get(args.scale.lower()) or int(args.scale)
+
+    start = time.perf_counter()
+    with app.app_context():
+        counts = seed(scale, args.favorites, args.seed)
+        dialect = db.engine.dialect.name
+
+    print(json.dumps({
+        'dialect': dialect,
+        'scale': scale,
+        'seed': args.seed,
+        'rows': counts,
+        'seconds': round(time.perf_counter() - start, 2)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
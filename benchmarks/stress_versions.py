@@ -0,0 +1,107 @@
+"""
+Lost update check for PUT. Several gunicorn workers serve one planet while
+CLIENTS threads keep adding 1 to its diameter with GET then PUT. With
+If-Match every increment that got a 200 must be in the final diameter, the
+412s are retried; the same run without If-Match shows how many increments a
+plain read-modify-write loses. The final diameter is read from the database,
+and the workers share an mmap cache so their GETs see each other's writes.
+
+    $ python benchmarks/stress_versions.py --clients 16 --increments 50
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+DATABASE = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE}'
+os.environ['CACHE_BACKEND'] = 'mmap'
+os.environ['CACHE_MMAP_PATH'] = DATABASE + '.cache'
+
+from load import start_gunicorn  # noqa: E402
+
+PLANET = {'planet_name': 'Stress', 'diameter': 0, 'rotation_period': 1, 'orbital_period': 1, 'climate': 'arid'}
+
+
+def request(connection, method, path, body=None, headers=None):
+    connection.request(method, path, json.dumps(body) if body is not None else None,
+                       dict(headers or {}, **{'Content-Type': 'application/json'}))
+    response = connection.getresponse()
+    return response.status, response.getheader('ETag'), json.loads(response.read() or 'null')
+
+def client(port, planet_id, increments, if_match, counts):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    done = 0
+    while done < increments:
+        status, etag, body = request(connection, 'GET', f'/planet/{planet_id}')
+        headers = {'If-Match': etag} if if_match else {}
+        status, _, _ = request(connection, 'PUT', f'/planet/{planet_id}', {'diameter': body['data']['diameter'] + 1}, headers)
+        counts[status] = counts.get(status, 0) + 1
+        if status == 200:
+            done += 1
+    connection.close()
+
+def run(port, args, if_match, read_diameter):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    _, _, body = request(connection, 'POST', '/planet', dict(PLANET, planet_name=f'Stress-{if_match}'))
+    planet_id = body['data']['planet_id']
+
+    counts = [{} for _ in range(args.clients)]
+    threads = [threading.Thread(target=client, args=(port, planet_id, args.increments, if_match, counts[index]))
+               for index in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    statuses = {}
+    for client_counts in counts:
+        for status, count in client_counts.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+    final = read_diameter(planet_id)
+    expected = args.clients * args.increments
+    return {'statuses': statuses, 'expected_diameter': expected, 'final_diameter': final, 'lost_updates': expected - final}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--increments', type=int, default=50, help='successful PUTs per client')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+    from app import app
+    from models import db, Planet
+    with app.app_context():
+        db.create_all()
+
+    def read_diameter(planet_id):
+        with app.app_context():
+            return db.session.get(Planet, planet_id).diameter
+
+    server = start_gunicorn('127.0.0.1', args.port, args.workers)
+    try:
+        report = {
+            'clients': args.clients,
+            'workers': args.workers,
+            'with_if_match': run(args.port, args, True, read_diameter),
+            'without_if_match': run(args.port, args, False, read_diameter)
+        }
+    finally:
+        server.terminate()
+        server.wait()
+        for path in (DATABASE, DATABASE + '-wal', DATABASE + '-shm', DATABASE + '.cache'):
+            if os.path.exists(path):
+                os.remove(path)
+    print(json.dumps(report, indent=2))
+    if report['with_if_match']['lost_updates']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
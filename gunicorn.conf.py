@@ -0,0 +1,44 @@
+"""
+Gunicorn settings, read from the directory gunicorn is started in:
+
+    $ gunicorn wsgi --chdir ./src/
+
+With GUNICORN_PRELOAD (default on) the master imports wsgi.py once, so the
+app, the mapped models and the search index are built a single time and
+shared by the forked workers copy-on-write, instead of every worker paying
+for them at boot. post_fork then drops what must not be shared: the pooled
+database connections and the cache file lock or socket.
+
+Workers are threaded (gthread) so a request waiting on scrypt, which runs
+on the password pool of credentials.py and releases the GIL, does not hold
+the whole worker: the other threads keep serving reads meanwhile.
+
+    APP_PROFILE=api       skip the admin, swagger and migrate (see app.py)
+    WEB_CONCURRENCY       workers, default 2; each has its own database pools
+    GUNICORN_THREADS      threads per worker, default 4 (keep DB_POOL_SIZE at least as high)
+    RATELIMIT_MAX_IN_FLIGHT  expensive requests a worker runs at once, default all threads but one
+    GUNICORN_WORKER_CLASS sync for one request per worker at a time
+    GUNICORN_PRELOAD=0    import the app in each worker instead
+"""
+import gc
+import os
+
+# not from cpu_count(), which counts the whole host on shared plans
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# read by ratelimit.py when the app is imported; beyond it the expensive routes get 503 and reads keep a thread
+os.environ.setdefault('RATELIMIT_MAX_IN_FLIGHT', str(max(1, threads - 1)))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes', 'on')
+
+
+def when_ready(server):
+    # the objects built so far are never freed, so the collector need not touch (and copy) their pages
+    if preload_app:
+        gc.freeze()
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import after_fork
+        # the app the master loaded, wsgi:application or app:app
+        after_fork(server.app.wsgi())
@@ -8,4 +8,6 @@ set -o errexit
 
 pipenv install
 
-pipenv run upgrade
\ No newline at end of file
+pipenv run upgrade
+# favorite_count starts at 0 on a database that had favorites before the column, later runs fix nothing
+pipenv run reconcile
\ No newline at end of file
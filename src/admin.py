@@ -1,22 +1,311 @@
+"""
+Flask-Admin views that stay fast on tables with millions of rows.
+
+- The admin has an engine of its own: ADMIN_DB_POOL_SIZE connections (2)
+  with an ADMIN_STATEMENT_TIMEOUT_MS statement timeout (5000, postgres), on
+  ADMIN_DATABASE_URL when set or on the API's database URL. Someone browsing
+  the admin never holds or waits for a connection of the API pool. The admin
+  edits rows, so ADMIN_DATABASE_URL must reach the primary too, e.g. through
+  another pooler or a role with its own connection limit; not a replica.
+- The list count is the planner's estimate (pg_class.reltuples,
+  sqlite_stat1) instead of a COUNT(*) over the whole table. Tables smaller
+  than ADMIN_COUNT_LIMIT rows, or never analyzed, and searches are counted
+  up to that many rows.
+- Pages are read with keyset conditions on the sort key plus the primary
+  key. Every page shown leaves an anchor for the pages next to it. A page
+  without an anchor (a jump from the pager) is a deferred join: the OFFSET
+  walks the index for the primary keys only and the rows of that page alone
+  are fetched.
+- Related users and entities are joined in the same query, loading only
+  their names.
+- Searches and sorts are limited to columns an index can serve. A search
+  term is a prefix range on text columns and an equality on integer columns,
+  never a LIKE '%term%' scan. Each view checks its lists against the table
+  indexes when it is created.
+"""
 import os
+import threading
+from collections import OrderedDict
 from flask_admin import Admin
-from models import db, User, Character, Planet, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
+from sqlalchemy import UniqueConstraint, create_engine, event, func, text, and_, or_, false
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import scoped_session, sessionmaker, joinedload
+from database import env_int, engine_options, is_sqlite_file, on_connect
+from listing import after_condition
+from models import db, User, Character, Planet, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles
+
+COUNT_LIMIT = env_int('ADMIN_COUNT_LIMIT', 10000)
+MAX_ANCHORS = 1000
+
+
+def admin_engine(app):
+    url = make_url(os.getenv('ADMIN_DATABASE_URL') or app.config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if backend == 'sqlite' and not is_sqlite_file(url):
+        # an in-memory database only exists on the app's own connection
+        with app.app_context():
+            return db.engine
+
+    options = dict(engine_options(url), pool_size=env_int('ADMIN_DB_POOL_SIZE', 2), max_overflow=0)
+    timeout = env_int('ADMIN_STATEMENT_TIMEOUT_MS', 5000)
+    if timeout and backend == 'postgresql' and url.get_driver_name() in ('psycopg2', 'psycopg'):
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    engine = create_engine(url, **options)
+    if backend == 'sqlite':
+        event.listen(engine, 'connect', on_connect(backend))
+    return engine
+
+def estimated_rows(session, table):
+    """Row count from the planner statistics, None when the table was never analyzed"""
+    dialect = session.get_bind().dialect
+    try:
+        if dialect.name == 'postgresql':
+            rows = session.execute(text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)'),
+                                   {'name': dialect.identifier_preparer.format_table(table)}).scalar()
+            return int(rows) if rows is not None and rows > 0 else None
+        if dialect.name == 'sqlite':
+            # one line per index, the first number is the rows it covers
+            stats = session.execute(text('SELECT stat FROM sqlite_stat1 WHERE tbl = :name'), {'name': table.name}).scalars()
+            counts = [int(stat.split()[0]) for stat in stats]
+            return max(counts) if counts else None
+    except OperationalError:
+        # no sqlite_stat1 before the first ANALYZE
+        session.rollback()
+    return None
+
+def leading_columns(table, partial=True):
+    """Names of the columns that lead an index of `table`, with or without the partial indexes"""
+    names = {column.name for column in table.primary_key}
+    names.update(next(iter(constraint.columns)).name for constraint in table.constraints
+                 if isinstance(constraint, UniqueConstraint))
+    for index in table.indexes:
+        if partial or not any(key.endswith('_where') and value is not None for key, value in index.dialect_kwargs.items()):
+            names.add(index.expressions[0].name)
+    return names
+
+def related_name(view, context, model, name):
+    related = getattr(model, name)
+    if related is None:
+        return None
+    return getattr(related, view.related_names[name].key)
+
+
+class NameLoader(QueryAjaxModelLoader):
+    """Select box of a related model, looked up by a prefix range on its name index instead of ILIKE '%term%'"""
+
+    def __init__(self, name, session, column):
+        super().__init__(name, session, column.class_, fields=(column.key,))
+        self.column = column
+
+    def format(self, model):
+        return (getattr(model, self.pk), getattr(model, self.column.key)) if model else None
+
+    def get_list(self, term, offset=0, limit=10):
+        return (
+            self.get_query()
+            .filter(self.column >= term, self.column < term + '\uffff')
+            .order_by(self.column)
+            .offset(offset).limit(limit).all()
+        )
+
+
+class IndexedModelView(ModelView):
+    """
+    ModelView with estimated counts, keyset pages and index-only search.
+    Subclasses set column_searchable_list and column_sortable_list to indexed
+    columns and related_names to {relationship: name column of the related model},
+    used for the list and the select boxes of the forms.
+    """
+    page_size = 20
+    can_set_page_size = False
+    column_display_pk = True
+    related_names = {}
+    # {column: criteria} added to a search on the column, to match the condition of its partial index
+    search_criteria = {}
+
+    def __init__(self, model, session, **kwargs):
+        table = model.__table__
+        for name in self.column_searchable_list or ():
+            if name not in leading_columns(table):
+                raise ValueError(f'{table.name}.{name} is not indexed and cannot be searched in the admin')
+        for name in self.column_sortable_list or ():
+            if name not in leading_columns(table, partial=False):
+                raise ValueError(f'{table.name}.{name} is not indexed and cannot be sorted in the admin')
+        self.column_formatters = dict(self.column_formatters or {}, **{name: related_name for name in self.related_names})
+        self.form_ajax_refs = {name: NameLoader(name, session, column) for name, column in self.related_names.items()}
+        self.pk = getattr(model, model.__mapper__.primary_key[0].key)
+        self.anchors = OrderedDict()
+        self.anchors_lock = threading.Lock()
+        super().__init__(model, session, **kwargs)
+
+    # the admin also manages deactivated accounts, which the default scope hides
+    def get_query(self):
+        return super().get_query().execution_options(include_inactive=True)
+
+    def get_count_query(self):
+        return super().get_count_query().execution_options(include_inactive=True)
+
+    def get_one(self, id):
+        return self.session.get(self.model, int(id), execution_options={'include_inactive': True})
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # every term must match one of the columns
+        for term in search.split():
+            clauses = []
+            for column, _ in self._search_fields:
+                if column.type.python_type is int:
+                    if term.isdigit():
+                        clauses.append(column == int(term))
+                else:
+                    clauses.append(and_(column >= term, column < term + '\uffff', *self.search_criteria.get(column.key, ())))
+            query = query.filter(or_(*clauses) if clauses else false())
+        return query, count_query, joins, count_joins
+
+    def count(self, query, searched):
+        if not searched:
+            estimate = estimated_rows(self.session, self.model.__table__)
+            if estimate is not None and estimate >= COUNT_LIMIT:
+                return estimate
+        limited = query.with_entities(self.pk).order_by(None).limit(COUNT_LIMIT).subquery()
+        return self.session.query(func.count()).select_from(limited).execution_options(include_inactive=True).scalar()
+
+    def sort_keys(self, sort_column, sort_desc):
+        """(column, descending) pairs of the order, always ending with the primary key"""
+        if sort_column is None or sort_column not in self._sortable_columns:
+            return [(self.pk, False)]
+        column = self._sortable_columns[sort_column]
+        if column.key == self.pk.key:
+            return [(self.pk, bool(sort_desc))]
+        return [(column, bool(sort_desc)), (self.pk, bool(sort_desc))]
+
+    def anchor(self, key):
+        with self.anchors_lock:
+            return self.anchors.get(key)
+
+    def remember(self, key, anchor, replace=True):
+        if any(value is None for value in anchor[1]):
+            # the keyset condition cannot compare NULLs, those pages use the deferred join
+            return
+        with self.anchors_lock:
+            if replace or key not in self.anchors:
+                self.anchors[key] = anchor
+                self.anchors.move_to_end(key)
+                if len(self.anchors) > MAX_ANCHORS:
+                    self.anchors.popitem(last=False)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        page = page or 0
+        page_size = self.page_size if page_size is None else page_size
+        query = self.get_query()
+        joins, count_joins = {}, {}
+        if self._search_supported and search:
+            query, _, joins, _ = self._apply_search(query, None, joins, count_joins, search)
+        if filters and self._filters:
+            query, _, joins, _ = self._apply_filters(query, None, joins, count_joins, filters)
+
+        count = None if self.simple_list_pager else self.count(query, bool(search or filters))
+
+        keys = self.sort_keys(sort_column, sort_desc)
+        ordered = query.order_by(*[column.desc() if descending else column.asc() for column, descending in keys])
+        listing = (sort_column, bool(sort_desc), search, tuple(map(tuple, filters or ())), page_size)
+        anchor = self.anchor(listing + (page,)) if page else None
+        reverse = False
+        if not page_size:
+            rows = ordered
+        elif not page:
+            rows = ordered.limit(page_size)
+        elif anchor and anchor[0] == 'after':
+            rows = ordered.filter(after_condition(keys, anchor[1])).limit(page_size)
+        elif anchor and execute:
+            # the page before an anchored one, read backwards from its first row
+            backwards = [(column, not descending) for column, descending in keys]
+            rows = (
+                query.filter(after_condition(backwards, anchor[1]))
+                .order_by(*[column.desc() if descending else column.asc() for column, descending in backwards])
+                .limit(page_size)
+            )
+            reverse = True
+        else:
+            page_keys = ordered.with_entities(self.pk).limit(page_size).offset(page * page_size).subquery()
+            rows = ordered.join(page_keys, self.pk == page_keys.c[self.pk.key])
+        rows = rows.options(*[joinedload(getattr(self.model, name)).load_only(column)
+                              for name, column in self.related_names.items()])
+        if not execute:
+            return count, rows
+
+        rows = rows.all()
+        if reverse:
+            rows.reverse()
+        if rows and page_size:
+            self.remember(listing + (page + 1,), ('after', [getattr(rows[-1], column.key) for column, _ in keys]))
+            if page:
+                self.remember(listing + (page - 1,), ('before', [getattr(rows[0], column.key) for column, _ in keys]), replace=False)
+        return count, rows
+
+
+class UserView(IndexedModelView):
+    column_exclude_list = ('password',)
+    form_excluded_columns = ('version', 'planets_favorites', 'characters_favorites', 'vehicles_favorites')
+    # the name and email indexes only hold active users, so only active users are found by them
+    column_searchable_list = ('id', 'user_name', 'email')
+    search_criteria = {'user_name': (User.is_active == True,), 'email': (User.is_active == True,)}  # noqa: E712
+    column_sortable_list = ('id', 'deactivated_at', 'updated_at')
+
+class PlanetView(IndexedModelView):
+    form_excluded_columns = ('version', 'favorite_count', 'favorite_by')
+    column_searchable_list = ('planet_id', 'planet_name')
+    column_sortable_list = ('planet_id', 'planet_name', 'diameter', 'climate', 'favorite_count', 'updated_at')
+
+class CharacterView(IndexedModelView):
+    form_excluded_columns = ('version', 'favorite_count', 'favorite_by')
+    column_searchable_list = ('character_id', 'character_name')
+    column_sortable_list = ('character_id', 'character_name', 'gender', 'age', 'favorite_count', 'updated_at')
+
+class VehicleView(IndexedModelView):
+    form_excluded_columns = ('version', 'favorite_count', 'favorite_by')
+    column_searchable_list = ('vehicle_id', 'vehicle_name')
+    column_sortable_list = ('vehicle_id', 'vehicle_name', 'passengers', 'load_capacity', 'favorite_count', 'updated_at')
+
+class FavoritePlanetsView(IndexedModelView):
+    column_list = ('id', 'user_relationship', 'planet_relationship')
+    column_labels = {'user_relationship': 'User', 'planet_relationship': 'Planet'}
+    column_searchable_list = ('user_id', 'planet_id')
+    column_sortable_list = ('id', 'user_id', 'planet_id')
+    related_names = {'user_relationship': User.user_name, 'planet_relationship': Planet.planet_name}
+
+class FavoriteCharactersView(IndexedModelView):
+    column_list = ('id', 'user_relationship', 'character_relationship')
+    column_labels = {'user_relationship': 'User', 'character_relationship': 'Character'}
+    column_searchable_list = ('user_id', 'character_id')
+    column_sortable_list = ('id', 'user_id', 'character_id')
+    related_names = {'user_relationship': User.user_name, 'character_relationship': Character.character_name}
+
+class FavoriteVehiclesView(IndexedModelView):
+    column_list = ('id', 'user_relationship', 'vehicle_relationship')
+    column_labels = {'user_relationship': 'User', 'vehicle_relationship': 'Vehicle'}
+    column_searchable_list = ('user_id', 'vehicle_id')
+    column_sortable_list = ('id', 'user_id', 'vehicle_id')
+    related_names = {'user_relationship': User.user_name, 'vehicle_relationship': Vehicle.vehicle_name}
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+    session = scoped_session(sessionmaker(bind=admin_engine(app)))
+    app.teardown_appcontext(lambda exception: session.remove())
+
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Character, db.session))
-    admin.add_view(ModelView(Planet, db.session))
-    admin.add_view(ModelView(Vehicle, db.session))
-    admin.add_view(ModelView(FavoritePlanets, db.session))
-    admin.add_view(ModelView(FavoriteCharacters, db.session))
-    admin.add_view(ModelView(FavoriteVehicles, db.session))
+    admin.add_view(UserView(User, session))
+    admin.add_view(CharacterView(Character, session))
+    admin.add_view(PlanetView(Planet, session))
+    admin.add_view(VehicleView(Vehicle, session))
+    admin.add_view(FavoritePlanetsView(FavoritePlanets, session))
+    admin.add_view(FavoriteCharactersView(FavoriteCharacters, session))
+    admin.add_view(FavoriteVehiclesView(FavoriteVehicles, session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, session))
@@ -1,543 +1,399 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
+
+create_app() builds the app for a profile, APP_PROFILE in the config or the
+environment:
+
+    full    every route plus the admin, /spec (swagger) and `flask db` (default)
+    api     only the API routes, for pods that serve traffic and nothing else
+
+Flask-Admin, Flask-Swagger and Flask-Migrate (alembic) are the slowest imports
+of the project, so they are imported inside the factory and only by the
+profiles that use them. `from app import app` still works and builds the
+default profile once, on first use.
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Flask, Blueprint, request, jsonify, current_app
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, Planet, Character, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles
+from werkzeug.routing import IntegerConverter
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import selectinload, configure_mappers
+from utils import APIException, generate_sitemap, etag_for, version_etag, expected_version, conditional_response
+from database import setup_database
+from commands import setup_commands
+from bulk import bulk_create, bulk_update, bulk_delete
+from cache import catalog_cache
+from credentials import hash_password, verify_password, needs_rehash
+from favorites import add_favorite, delete_favorite, update_favorites
+from json_provider import setup_json
+from leaderboard import most_favorited, MAX_LIMIT as LEADERBOARD_MAX_LIMIT
+from metrics import setup_metrics
+import ratelimit
+from resources import setup_resources, USER, coerce_values, creation_error, update_error, conditional_update, update_failure
+from search import search_backend, SEARCHABLE
+from listing import keyset_page, list_etag, wants_stream, stream_rows
+from models import db, default_scope, integer_bounds, User, Planet, Character, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles
 #from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+api = Blueprint('api', __name__)
+
+
+class IdConverter(IntegerConverter):
+    """<int:...> limited to the integer columns, a larger id is a 404 instead of a database error"""
+
+    def __init__(self, map, *args, **kwargs):
+        kwargs.setdefault('max', integer_bounds(User.id)[1])
+        super().__init__(map, *args, **kwargs)
+
+
+def setup_migrate(app):
+    from flask_migrate import Migrate
+    Migrate(app, db)
+
+def setup_admin(app):
+    import admin
+    admin.setup_admin(app)
+
+def setup_swagger(app):
+    from flask_swagger import swagger
+    app.add_url_rule('/spec', 'spec', lambda: jsonify(swagger(app)))
+
+EXTENSIONS = {'migrate': setup_migrate, 'admin': setup_admin, 'swagger': setup_swagger}
+PROFILES = {
+    'full': ('migrate', 'admin', 'swagger'),
+    'api': ()
+}
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    app.url_map.converters['int'] = IdConverter
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['APP_PROFILE'] = os.getenv('APP_PROFILE', 'full')
+    app.config.update(config or {})
+    if app.config['APP_PROFILE'] not in PROFILES:
+        raise ValueError(f'APP_PROFILE must be one of {", ".join(PROFILES)}')
+
+    setup_database(app, db)
+    CORS(app)
+    setup_json(app)
+    setup_metrics(app)
+    ratelimit.setup_ratelimit(app)
+    setup_commands(app)
+    setup_resources(app)
+    app.register_blueprint(api)
+    for extension in PROFILES[app.config['APP_PROFILE']]:
+        EXTENSIONS[extension](app)
+    return app
+
+def warm_up(app):
+    """Work every process would otherwise do on its first requests, done before gunicorn forks the workers"""
+    configure_mappers()
+    app.url_map.update()
+    with app.app_context():
+        try:
+            search_backend.ensure_fresh()
+        except SQLAlchemyError:
+            # no schema yet, the workers build the index on their first search
+            app.logger.warning('search index not built at startup', exc_info=True)
+        db.session.remove()
+
+def after_fork(app):
+    """In a worker forked from a preloaded master: nothing that holds a socket or file lock is shared"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+    catalog_cache.after_fork()
+    search_backend.after_fork()
+    ratelimit.after_fork()
+
+_app = None
+
+def __getattr__(name):
+    # `from app import app`, `flask run` and `gunicorn app:app` build the default profile once
+    global _app
+    if name != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if _app is None:
+        _app = create_app()
+    return _app
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(current_app)
 
-@app.route('/user', methods=['GET'])
-def get_all_users():
-    all_users = User.query.all()
+@api.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({
+        'msg': 'GET catalog cache stats',
+        'data': catalog_cache.stats()
+    }), 200
+
+@api.route('/search', methods=['GET'])
+def search_names():
+    prefix = request.args.get('q', '').strip()
+    if not prefix:
+        return jsonify({'msg': 'You must send the q parameter'}), 400
+    kinds = request.args.get('type', ','.join(SEARCHABLE)).split(',')
+    if any(kind not in SEARCHABLE for kind in kinds):
+        return jsonify({'msg': 'type must be planet, character and/or vehicle'}), 400
+    limit = request.args.get('limit', 10, type=int)
 
     return jsonify({
-        'msg': 'GET all users ',
-        'data': list(map(User.serialize, all_users))
+        'msg': f'Names starting with {prefix}',
+        'data': search_backend.search(prefix, set(kinds), max(1, min(limit, 100)))
     }), 200
 
-@app.route('/user/<int:user_id>', methods=['GET'])
+@api.route('/user', methods=['GET'])
+def get_all_users():
+    if wants_stream():
+        return stream_rows(User)
+
+    def build():
+        users, next_cursor = keyset_page(User)
+        return jsonify({
+            'msg': USER['list_msg'],
+            'data': users,
+            'next': next_cursor
+        }), 200
+
+    return conditional_response(list_etag(User), build)
+
+@api.route('/user/<int:user_id>', methods=['GET'])
 def get_single_user(user_id):
     single_user = User.query.get(user_id)
     if single_user is None:
-        return jsonify({'msg': f'User with id {user_id} does not exist'}), 404    
+        return jsonify({'msg': USER['missing_msg'].format(user_id)}), 404
 
-    return jsonify({
-        'msg': 'GET single user ',
+    return conditional_response(version_etag('user', user_id, single_user.version), lambda: (jsonify({
+        'msg': USER['single_msg'],
         'data': single_user.serialize()
-    }), 200
+    }), 200), single_user.updated_at)
 
-@app.route('/user', methods=['POST'])
+@api.route('/user', methods=['POST'])
 def add_user():
     body = request.get_json(silent=True)
     if body is None:
         return jsonify({'msg': 'You must send information in the body'}), 400
     
-    required_fields = ['user_name', 'email', 'password', 'is_active'] 
-       
-    if not all(field in body for field in required_fields):
-            return jsonify({'msg': 'The fields user_name, email, password and is_active are required'}), 400
-    for field in body:
-        if field not in required_fields:
-            return jsonify({'msg': 'allowed fields user_name, email, password and is_active'}), 400
-    
-    if User.query.filter_by(user_name=body['user_name']).first() or User.query.filter_by(email=body['email']).first():
-        return jsonify({'msg': 'User with this username or email already exists'}), 400    
-    
-    new_user = User(**body)
+    error = creation_error(USER, body)
+    if error is None:
+        values, error = coerce_values(USER, body)
+    if error is not None:
+        return jsonify({'msg': error}), 400
+
+    new_user = User(**dict(values, password=hash_password(values['password'])))
+    if not new_user.is_active:
+        new_user.deactivated_at = datetime.utcnow()
     db.session.add(new_user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the unique indexes on the names and emails of active users
+        db.session.rollback()
+        return jsonify({'msg': 'User with this username or email already exists'}), 409
 
     return jsonify({
         'msg': 'New user created',
         'data': new_user.serialize()
     }), 201
 
-@app.route('/user/<int:user_id>', methods=['DELETE'])
+@api.route('/user/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id, execution_options={'include_inactive': True})
     if user is None:
         return jsonify({'msg':f'User with id {user_id} not found'}), 404
     
     if not user.is_active:
         return jsonify({'msg': f'User with id {user_id} is already deactivated'}), 400
     
-    user.is_active = False   
+    # a Core UPDATE like PUT, limited to the version just read
+    if conditional_update(User, user_id, {'is_active': False, 'deactivated_at': datetime.utcnow()}, user.version) is None:
+        db.session.rollback()
+        return jsonify({'msg': f'User with id {user_id} was modified while deactivating it, try again'}), 409
     db.session.commit()
 
     return jsonify({'msg':f'User with id {user_id} deactivated'}), 200
     
-@app.route('/user/<int:user_id>', methods=['PUT'])
+@api.route('/user/<int:user_id>', methods=['PUT'])
 def modified_user(user_id):
-
-    user = User.query.get(user_id)     
-    if user is None:
-        return jsonify({'msg':f'User with id {user_id} not found'}), 404
-    
     body = request.get_json(silent=True)
     if not body:
         return jsonify({'msg':'You must send information in the body'}), 400
     
-    allowed_fields = ['user_name', 'email', 'password', 'is_active']
-    for field in body:
-        if field not in allowed_fields:
-            return jsonify({'msg': 'allowed fields user_name, email, password and is_active'}), 400
-    
-    if 'user_name' in body:
-        if User.query.filter_by(user_name=body['user_name']).first():
-            return jsonify({'msg': 'This username already exists'}), 400
-        
-    if 'email' in body:            
-        if User.query.filter_by(email=body['email']).first():
-            return jsonify({'msg': 'This email already exists'}), 400
-    
-    if 'user_name' in body:
-        user.user_name = body['user_name']
-    if 'email' in body:
-        user.email = body['email']    
-    if 'password' in body:
-        user.password = body['password']
-    if 'is_active' in body:
-        user.is_active = body['is_active'] 
+    error = update_error(USER, body)
+    if error is None:
+        values, error = coerce_values(USER, body)
+    if error is not None:
+        return jsonify({'msg': error}), 400
+
+    if 'password' in values:
+        values['password'] = hash_password(values['password'])
+    if 'is_active' in values:
+        # keep the original date when an inactive user is deactivated again
+        values['deactivated_at'] = None if values['is_active'] else func.coalesce(User.deactivated_at, datetime.utcnow())
+    try:
+        version = conditional_update(User, user_id, values, expected_version('user', user_id))
+    except IntegrityError:
+        # the name or email belongs to another active user
+        db.session.rollback()
+        return jsonify({'msg': 'User with this username or email already exists'}), 409
+    if version is None:
+        db.session.rollback()
+        return update_failure(User, user_id, f'User with id {user_id} not found')
     db.session.commit()
 
-    return jsonify({'msg':f'User with id {user_id} modified successfully'}), 200
-
-@app.route('/planet', methods=['GET'])
-def get_all_planets():
-    all_planets = Planet.query.all()
-    
-    return jsonify({
-        'msg': 'GET all PLanets',
-        'data': list(map(Planet.serialize, all_planets))
-    })
-
-@app.route('/planet/<int:planet_id>', methods=['GET'])
-def get_single_planet(planet_id):
-    single_planet = Planet.query.get(planet_id)
-    if single_planet is None:
-        return jsonify({'msg': f'Planet with id {planet_id} does not exist'}), 404
-    return jsonify({
-        'msg': 'GET single planet',
-        'data': single_planet.serialize()
-    })
+    response = jsonify({'msg':f'User with id {user_id} modified successfully'})
+    response.set_etag(version_etag('user', user_id, version))
+    return response, 200
 
-@app.route('/planet', methods=['POST'])
-def add_planet():
+@api.route('/login', methods=['POST'])
+def login():
     body = request.get_json(silent=True)
-    if body is None:
-        return jsonify({'msg': 'You must send information in the body'}), 400
-    
-    required_fields = ['planet_name', 'diameter', 'rotation_period', 'orbital_period', 'climate']
-    if not all(field in body for field in required_fields):
-        return jsonify({'msg': 'The fields planet_name, diameter, rotation_period, orbital_period and climate are required'}), 400
-    for field in body:
-        if field not in required_fields:
-            return jsonify({'msg': 'Allowed fields planet_name, diameter, rotation_period, orbital_period and climate'}), 400
-    
-    if Planet.query.filter_by(planet_name=body['planet_name']).first():
-        return jsonify({'msg': 'Planet name already exists'}), 400
-    
-    new_planet = Planet(**body)
-    db.session.add(new_planet)
-    db.session.commit()
-
-    return jsonify ({
-        'msg': 'New planet created',
-        'data': new_planet.serialize()
-    }), 201
-
-@app.route('/planet/<int:planet_id>', methods=['DELETE'])
-def delete_planet(planet_id):
-    planet = Planet.query.get(planet_id)
-    if planet is None:
-        return jsonify({'msg': f'Planet with id {planet_id} not found'}), 404
-    db.session.delete(planet)
-    db.session.commit()
-
-    return jsonify({'msg': f'Planet with id {planet_id} delete'}), 200
+    if not isinstance(body, dict) or not isinstance(body.get('password'), str) \
+            or not isinstance(body.get('email', body.get('user_name')), str):
+        return jsonify({'msg': 'You must send email or user_name and password in the body'}), 400
 
-@app.route('/planet/<int:planet_id>', methods=['PUT'])
-def modified_planet(planet_id):
-
-    planet = Planet.query.get(planet_id)
-    if planet is None:
-        return jsonify({'msg':f'Planet with id {planet_id} not found'}), 404
-    
-    body = request.get_json(silent=True)
-    if not body:
-        return jsonify({'msg':'You must send information in the body'}), 400
-    
-    allowed_fields = ['planet_name', 'diameter', 'rotation_period', 'orbital_period', 'climate']
-    for field in body:
-        if field not in allowed_fields:
-            return jsonify({'msg': 'allowed fields planet_name, diameter, rotation_period, orbital_period and climate'}), 400
-
-    if 'planet_name' in body:
-        if Planet.query.filter_by(planet_name=body['planet_name']).first():
-            return jsonify({'msg': 'Planet name already exists'}), 400
-
-    if 'planet_name' in body:
-        planet.planet_name = body['planet_name']
-    if 'diameter' in body:
-        planet.diameter = body['diameter']
-    if 'rotation_period' in body:
-        planet.rotation_period = body['rotation_period']
-    if 'orbital_period' in body:
-        planet.orbital_period = body['orbital_period']
-    if 'climate' in body:
-        planet.climate = body['climate'] 
-    db.session.commit()
+    if 'email' in body:
+        user = User.query.filter_by(email=body['email']).first()
+    else:
+        user = User.query.filter_by(user_name=body['user_name']).first()
+    if not verify_password(body['password'], user.password if user else None) or not user.is_active:
+        return jsonify({'msg': 'Invalid credentials'}), 401
+
+    # upgrade plaintext passwords and hashes made with older cost parameters
+    if needs_rehash(user.password):
+        # skipped when the user changed since it was read, the next login upgrades it
+        if conditional_update(User, user.id, {'password': hash_password(body['password'])}, user.version) is None:
+            db.session.rollback()
+        else:
+            db.session.commit()
 
-    return jsonify({'msg':f'Planet with id {planet_id} modified successfully'}), 200       
-                   
-@app.route('/character', methods=['GET'])
-def get_all_characters():
-    all_characters = Character.query.all()
-    
-    return jsonify({
-        'msg': 'GET all Characters',
-        'data': list(map(Character.serialize, all_characters))
-    })
-
-@app.route('/character/<int:character_id>', methods=['GET'])
-def get_single_character(character_id):
-    single_character = Character.query.get(character_id)
-    if single_character is None:
-        return jsonify({'msg': f'Character with id {character_id} does not exist'}), 404
     return jsonify({
-        'msg': 'GET single character',
-        'data': single_character.serialize()
-    })
-
-@app.route('/character', methods=['POST'])
-def add_character():
-    body = request.get_json(silent=True)
-    if body is None:
-        return jsonify({'msg': 'You must send information in the body'}), 400
-    
-    required_fields = ['character_name', 'skin_color', 'hair_color', 'gender', 'age']
-    if not all(field in body for field in required_fields):
-        return jsonify({'msg': 'The fields character_name, skin_color, hair_color, gender and age are required'}), 400
-    for field in body:
-        if field not in required_fields:
-            return jsonify({'msg': 'allowed fields character_name, skin_color, hair_color, gender and age'}), 400
-    
-    if Character.query.filter_by(character_name=body['character_name']).first():
-        return jsonify({'msg': 'Character name already exists'}), 400
-    
-    new_character = Character(**body)
-    db.session.add(new_character)
-    db.session.commit()
-
-    return jsonify ({
-        'msg': 'New character created',
-        'data': new_character.serialize()
-    }), 201
-
-@app.route('/character/<int:character_id>', methods=['DELETE'])
-def delete_character(character_id):
-    character = Character.query.get(character_id)
-    if character is None:
-        return jsonify({'msg': f'Character with id {character_id} not found'}), 404
-    db.session.delete(character)
-    db.session.commit()
-
-    return jsonify({'msg': f'Character with id {character_id} delete'}), 200
-
-@app.route('/character/<int:character_id>', methods=['PUT'])
-def modified_character(character_id):
-
-    character = Character.query.get(character_id)
-    if character is None:
-        return jsonify({'msg':f'Character with id {character_id} not found'}), 404
-    
-    body = request.get_json(silent=True)
-    if not body:
-        return jsonify({'msg':'You must send information in the body'}), 400
-    
-    allowed_fields = ['character_name', 'skin_color', 'hair_color', 'gender', 'age']
-    for field in body:
-        if field not in allowed_fields:
-            return jsonify({'msg': 'allowed fields character_name, skin_color, hair_color, gender and age'}), 400
-
-    if 'character_name' in body:
-        if Character.query.filter_by(character_name=body['character_name']).first():
-            return jsonify({'msg': 'Character name already exists'}), 400
-
-    if 'character_name' in body:
-        character.character_name = body['character_name']
-    if 'skin_color' in body:
-        character.skin_color = body['skin_color']
-    if 'hair_color' in body:
-        character.hair_color = body['hair_color']
-    if 'gender' in body:
-        character.gender = body['gender']
-    if 'age' in body:
-        character.age = body['age'] 
-    db.session.commit()
-
-    return jsonify({'msg':f'Character with id {character_id} modified successfully'}), 200  
+        'msg': 'Login successful',
+        'data': user.serialize()
+    }), 200
 
-@app.route('/vehicle', methods=['GET'])
-def get_all_vehicles():
-    all_vehicle = Vehicle.query.all()
-    
+@api.route('/<any(planet, character, vehicle):kind>/bulk', methods=['POST'])
+def add_bulk(kind):
+    body, status = bulk_create(kind)
+    return jsonify(body), status
+
+@api.route('/<any(planet, character, vehicle):kind>/bulk', methods=['PUT'])
+def modified_bulk(kind):
+    body, status = bulk_update(kind)
+    return jsonify(body), status
+
+@api.route('/<any(planet, character, vehicle):kind>/bulk', methods=['DELETE'])
+def delete_bulk(kind):
+    body, status = bulk_delete(kind)
+    return jsonify(body), status
+
+@api.route('/<any(planet, character, vehicle):kind>/top', methods=['GET'])
+def get_most_favorited(kind):
+    limit = request.args.get('limit', '20')
+    if not limit.isdigit() or not 1 <= int(limit) <= LEADERBOARD_MAX_LIMIT:
+        raise APIException(f'limit must be an integer between 1 and {LEADERBOARD_MAX_LIMIT}')
     return jsonify({
-        'msg': 'GET all Vehicle',
-        'data': list(map(Vehicle.serialize, all_vehicle))
-    })
-
-@app.route('/vehicle/<int:vehicle_id>', methods=['GET'])
-def get_single_vehicle(vehicle_id):
-    single_vehicle = Vehicle.query.get(vehicle_id)
-    if single_vehicle is None:
-        return jsonify({'msg': f'vehicle with id {vehicle_id} does not exist'}), 404
-    return jsonify({
-        'msg': 'GET single vehicle',
-        'data': single_vehicle.serialize()
-    })
-
-@app.route('/vehicle', methods=['POST'])
-def add_vehicle():
-    body = request.get_json(silent=True)
-    if body is None:
-        return jsonify({'msg': 'You must send information in the body'}), 400
-    
-    required_fields = ['vehicle_name', 'passengers', 'load_capacity', 'armament', 'length']
-    if not all(field in body for field in required_fields):
-        return jsonify({'msg': 'The fields vehicle_name, passengers, load_capacity, armament and length are required'}), 400
-    for field in body:
-        if field not in required_fields:
-            return jsonify({'msg': 'allowed fields vehicle_name, passengers, load_capacity, armament and length'}), 400
-    
-    if Vehicle.query.filter_by(vehicle_name=body['vehicle_name']).first():
-        return jsonify({'msg': 'vehicle name already exists'}), 400
-    
-    new_vehicle = Vehicle(**body)
-    db.session.add(new_vehicle)
-    db.session.commit()
-
-    return jsonify ({
-        'msg': 'New vehicle created',
-        'data': new_vehicle.serialize()
-    }), 201
-
-@app.route('/vehicle/<int:vehicle_id>', methods=['DELETE'])
-def delete_vehicle(vehicle_id):
-    vehicle = Vehicle.query.get(vehicle_id)
-    if vehicle is None:
-        return jsonify({'msg': f'Vehicle with id {vehicle_id} not found'}), 404
-    db.session.delete(vehicle)
-    db.session.commit()
-
-    return jsonify({'msg': f'Vehicle with id {vehicle_id} delete'}), 200
-
-@app.route('/vehicle/<int:vehicle_id>', methods=['PUT'])
-def modified_vehicle(vehicle_id):
-
-    vehicle = Vehicle.query.get(vehicle_id)
-    if vehicle is None:
-        return jsonify({'msg':f'Vehicle with id {vehicle_id} not found'}), 404
-    
-    body = request.get_json(silent=True)
-    if not body:
-        return jsonify({'msg':'You must send information in the body'}), 400
-    
-    allowed_fields = ['vehicle_name', 'passengers', 'load_capacity', 'armament', 'length']
-    for field in body:
-        if field not in allowed_fields:
-            return jsonify({'msg': 'allowed fields vehicle_name, passengers, load_capacity, armament and length'}), 400
-
-    if 'vehicle_name' in body:
-        if Vehicle.query.filter_by(vehicle_name=body['vehicle_name']).first():
-            return jsonify({'msg': 'vehicle name already exists'}), 400
-
-    if 'vehicle_name' in body:
-        vehicle.vehicle_name = body['vehicle_name']
-    if 'passengers' in body:
-        vehicle.passengers = body['passengers']
-    if 'load_capacity' in body:
-        vehicle.load_capacity = body['load_capacity']
-    if 'armament' in body:
-        vehicle.armament = body['armament']
-    if 'length' in body:
-        vehicle.length = body['length'] 
-    db.session.commit()
-
-    return jsonify({'msg':f'Vehicle with id {vehicle_id} modified successfully'}), 200  
+        'msg': f'GET most favorited {kind}s',
+        'data': most_favorited(kind, int(limit))
+    }), 200
 
-@app.route('/user/<int:id_user>/favorites', methods=['GET'])
+def favorites_etag_select(id_user):
+    # one aggregate statement over the three favorite tables and the entities they point to
+    kinds = [
+        (FavoritePlanets, FavoritePlanets.planet_id, Planet, Planet.planet_id),
+        (FavoriteCharacters, FavoriteCharacters.character_id, Character, Character.character_id),
+        (FavoriteVehicles, FavoriteVehicles.vehicle_id, Vehicle, Vehicle.vehicle_id)
+    ]
+    columns = [db.select(User.updated_at).where(User.id == id_user, *default_scope(User)).scalar_subquery()]
+    for favorite, entity_fk, entity, entity_pk in kinds:
+        for aggregate in (func.count(favorite.id), func.max(favorite.id), func.sum(entity_fk), func.max(entity.updated_at)):
+            columns.append(
+                db.select(aggregate).select_from(favorite).join(entity, entity_pk == entity_fk).where(favorite.user_id == id_user).scalar_subquery()
+            )
+    return db.select(*columns)
+
+def favorites_etag_for(id_user, validators):
+    if validators[0] is None:
+        return None
+    return etag_for('favorites', id_user, *validators)
+
+def favorites_etag(id_user):
+    return favorites_etag_for(id_user, db.session.execute(favorites_etag_select(id_user)).one())
+
+@api.route('/user/<int:id_user>/favorites', methods=['GET'])
 def get_favorites(id_user):
-    favorite_planets = FavoritePlanets.query.filter_by(user_id = id_user).all()
-    favorite_characters = FavoriteCharacters.query.filter_by(user_id = id_user).all()
-    favorite_vehicles = FavoriteVehicles.query.filter_by(user_id = id_user).all()
+    etag = favorites_etag(id_user)
+    if etag is None:
+        return jsonify({'msg': USER['missing_msg'].format(id_user)}), 404
+    return conditional_response(etag, lambda: build_favorites(id_user))
+
+def build_favorites(id_user):
+    # one query for the user plus one per favorite kind, however many favorites there are
+    user = User.query.options(
+        selectinload(User.planets_favorites).joinedload(FavoritePlanets.planet_relationship),
+        selectinload(User.characters_favorites).joinedload(FavoriteCharacters.character_relationship),
+        selectinload(User.vehicles_favorites).joinedload(FavoriteVehicles.vehicle_relationship)
+    ).filter_by(id=id_user).first()
+    if user is None:
+        return jsonify({'msg': USER['missing_msg'].format(id_user)}), 404
+
     return jsonify ({
         'msg': f'GET all favorites of user with id {id_user}',
         'data': {
-            'favorite_planets': list(map(FavoritePlanets.serialize, favorite_planets)),
-            'favorite_characters': list(map(FavoriteCharacters.serialize, favorite_characters)),
-            'favorite_vehicles': list(map(FavoriteVehicles.serialize, favorite_vehicles)),
-            'user_data': favorite_planets[0].user_relationship.serialize()
+            'favorite_planets': list(map(FavoritePlanets.serialize, user.planets_favorites)),
+            'favorite_characters': list(map(FavoriteCharacters.serialize, user.characters_favorites)),
+            'favorite_vehicles': list(map(FavoriteVehicles.serialize, user.vehicles_favorites)),
+            'user_data': user.serialize()
         }
     }), 200
 
-@app.route('/favorite/planet/<int:planet_id>/<int:user_id>', methods=['POST'])
-def add_favorite_planet(planet_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'The user does not exist'}), 404    
-    
-    planet = Planet.query.get(planet_id)
-    if planet is None:
-        return jsonify({'msg': 'The planet does not exist'}), 404    
-    
-    if FavoritePlanets.query.filter_by(user_id=user_id, planet_id=planet_id).first():
-        return jsonify({'msg': 'Planet is already a favorite'}), 400
-    
-    new_favorite_planet = FavoritePlanets()
-    new_favorite_planet.user_id = user_id
-    new_favorite_planet.planet_id = planet_id
+@api.route('/user/<int:id_user>/favorites', methods=['POST'])
+def update_user_favorites(id_user):
+    body, status = update_favorites(id_user, request.get_json(silent=True))
+    return jsonify(body), status
 
-    db.session.add(new_favorite_planet)
-    db.session.commit()
-    
-    return jsonify({'msg': 'Planet added to favorites'}), 201
+@api.route('/favorite/planet/<int:planet_id>/<int:user_id>', methods=['POST'])
+def add_favorite_planet(planet_id, user_id):
+    body, status = add_favorite('planet', user_id, planet_id)
+    return jsonify(body), status
 
-@app.route('/favorite/planet/<int:planet_id>/<int:user_id>', methods=['DELETE'])
+@api.route('/favorite/planet/<int:planet_id>/<int:user_id>', methods=['DELETE'])
 def delete_favorite_planet(planet_id, user_id):
-    
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'User not found'}), 404    
-    
-    planet = Planet.query.get(planet_id)
-    if planet is None:
-        return jsonify({'msg': 'Planet not found'}), 404    
-    
-    favorite_planet = FavoritePlanets.query.filter_by(user_id=user_id, planet_id=planet_id).first()
-    if favorite_planet is None:
-        return jsonify({'msg': 'Favorite planet not found'}), 404    
-    
-    db.session.delete(favorite_planet)
-    db.session.commit()
-    
-    return jsonify({'msg': 'Favorite planet deleted'}), 200
+    body, status = delete_favorite('planet', user_id, planet_id)
+    return jsonify(body), status
 
-@app.route('/favorite/character/<int:character_id>/<int:user_id>', methods=['POST'])
+@api.route('/favorite/character/<int:character_id>/<int:user_id>', methods=['POST'])
 def add_favorite_character(character_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'The user does not exist'}), 404    
-    
-    character = Character.query.get(character_id)
-    if character is None:
-        return jsonify({'msg': 'The character does not exist'}), 404    
-    
-    if FavoriteCharacters.query.filter_by(user_id=user_id, character_id=character_id).first():
-        return jsonify({'msg': 'character is already a favorite'}), 400
-    
-    new_favorite_character = FavoriteCharacters()
-    new_favorite_character.user_id = user_id
-    new_favorite_character.character_id = character_id
+    body, status = add_favorite('character', user_id, character_id)
+    return jsonify(body), status
 
-    db.session.add(new_favorite_character)
-    db.session.commit()
-    
-    return jsonify({'msg': 'character added to favorites'}), 201
-
-@app.route('/favorite/character/<int:character_id>/<int:user_id>', methods=['DELETE'])
+@api.route('/favorite/character/<int:character_id>/<int:user_id>', methods=['DELETE'])
 def delete_favorite_character(character_id, user_id):
-    
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'User not found'}), 404    
-    
-    character = Character.query.get(character_id)
-    if character is None:
-        return jsonify({'msg': 'Character not found'}), 404    
-    
-    favorite_character = FavoriteCharacters.query.filter_by(user_id=user_id, character_id=character_id).first()
-    if favorite_character is None:
-        return jsonify({'msg': 'Favorite character not found'}), 404    
-    
-    db.session.delete(favorite_character)
-    db.session.commit()
-    
-    return jsonify({'msg': 'Favorite character deleted'}), 200
+    body, status = delete_favorite('character', user_id, character_id)
+    return jsonify(body), status
 
-@app.route('/favorite/vehicle/<int:vehicle_id>/<int:user_id>', methods=['POST'])
+@api.route('/favorite/vehicle/<int:vehicle_id>/<int:user_id>', methods=['POST'])
 def add_favorite_vehicle(vehicle_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'The user does not exist'}), 404    
-    
-    vehicle = Vehicle.query.get(vehicle_id)
-    if vehicle is None:
-        return jsonify({'msg': 'The vehicle does not exist'}), 404    
-    
-    if FavoriteVehicles.query.filter_by(user_id=user_id, vehicle_id=vehicle_id).first():
-        return jsonify({'msg': 'Vehicle is already a favorite'}), 400
-    
-    new_favorite_vehicle = FavoriteVehicles()
-    new_favorite_vehicle.user_id = user_id
-    new_favorite_vehicle.vehicle_id = vehicle_id
-
-    db.session.add(new_favorite_vehicle)
-    db.session.commit()
-    
-    return jsonify({'msg': 'Vehicle added to favorites'}), 201
+    body, status = add_favorite('vehicle', user_id, vehicle_id)
+    return jsonify(body), status
 
-@app.route('/favorite/vehicle/<int:vehicle_id>/<int:user_id>', methods=['DELETE'])
+@api.route('/favorite/vehicle/<int:vehicle_id>/<int:user_id>', methods=['DELETE'])
 def delete_favorite_vehicle(vehicle_id, user_id):
-    
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'User not found'}), 404    
-    
-    vehicle = Vehicle.query.get(vehicle_id)
-    if vehicle is None:
-        return jsonify({'msg': 'Vehicle not found'}), 404    
-    
-    favorite_vehicle = FavoriteVehicles.query.filter_by(user_id=user_id, vehicle_id=vehicle_id).first()
-    if favorite_vehicle is None:
-        return jsonify({'msg': 'Favorite vehicle not found'}), 404    
-    
-    db.session.delete(favorite_vehicle)
-    db.session.commit()
-    
-    return jsonify({'msg': 'Favorite vehicle deleted'}), 200
+    body, status = delete_favorite('vehicle', user_id, vehicle_id)
+    return jsonify(body), status
 
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,78 @@
+"""
+Purge of long deactivated users.
+
+DELETE /user only deactivates the account, so the user and favorite tables
+keep every row ever created. Users deactivated more than `older_than_days`
+ago are moved, together with their favorites, to the *_archive tables, one
+batch of users per transaction so the hot tables are never locked for long.
+Users deactivated before deactivated_at was added have it NULL and are aged by
+updated_at instead.
+favorite_count of the entities that lose favorites is recounted in the same
+transaction.
+"""
+from datetime import datetime, timedelta
+from favorites import FAVORITE_KINDS, recount
+from leaderboard import favorites_changed
+from models import db, User, UserArchive, FavoritePlanetsArchive, FavoriteCharactersArchive, FavoriteVehiclesArchive
+
+ARCHIVES = {
+    'planet': FavoritePlanetsArchive,
+    'character': FavoriteCharactersArchive,
+    'vehicle': FavoriteVehiclesArchive
+}
+USER_COLUMNS = ('user_name', 'email', 'password', 'updated_at', 'deactivated_at')
+
+
+def archive_favorites(kind, user_ids, archived_at):
+    """Moves the favorites of `user_ids` to the archive. Returns the new counts of the entities they pointed to."""
+    spec = FAVORITE_KINDS[kind]
+    favorite = spec['model']
+    entity_fk = getattr(favorite, spec['column'])
+    owned = favorite.user_id.in_(user_ids)
+    entity_ids = db.session.execute(db.select(entity_fk).where(owned).distinct()).scalars().all()
+    if not entity_ids:
+        return {}
+    db.session.execute(db.insert(ARCHIVES[kind]).from_select(
+        ['favorite_id', 'user_id', spec['column'], 'archived_at'],
+        db.select(favorite.id, favorite.user_id, entity_fk, db.literal(archived_at)).where(owned)
+    ))
+    db.session.execute(db.delete(favorite).where(owned).execution_options(synchronize_session=False))
+    return recount(kind, entity_ids)
+
+def archive_users(user_ids, archived_at):
+    db.session.execute(db.insert(UserArchive).from_select(
+        ['user_id', *USER_COLUMNS, 'archived_at'],
+        db.select(User.id, *[getattr(User, column) for column in USER_COLUMNS], db.literal(archived_at))
+        .where(User.id.in_(user_ids))
+    ))
+    db.session.execute(db.delete(User).where(User.id.in_(user_ids)).execution_options(synchronize_session=False))
+
+def purge_inactive_users(older_than_days, batch=1000):
+    """
+    Archives users deactivated more than `older_than_days` days ago and their
+    favorites, `batch` users per transaction. Returns how many were archived.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    candidates = (
+        db.select(User.id)
+        .where(User.is_active == False, db.or_(  # noqa: E712
+            User.deactivated_at < cutoff,
+            # deactivated before the column existed, their last change is the deactivation at the latest
+            db.and_(User.deactivated_at.is_(None), User.updated_at < cutoff)
+        ))
+        .order_by(User.id)
+        .limit(batch)
+        .execution_options(include_inactive=True)
+    )
+    purged = 0
+    while True:
+        user_ids = db.session.execute(candidates).scalars().all()
+        if not user_ids:
+            return purged
+        archived_at = datetime.utcnow()
+        counts = {kind: archive_favorites(kind, user_ids, archived_at) for kind in FAVORITE_KINDS}
+        archive_users(user_ids, archived_at)
+        db.session.commit()
+        for kind, changed in counts.items():
+            favorites_changed(kind, changed)
+        purged += len(user_ids)
@@ -0,0 +1,223 @@
+"""
+ASGI entry point.
+
+The read routes that spend their time waiting on the database (catalog and
+user lists, single entities and a user's favorites) are answered by async
+handlers on an async engine (aiosqlite or asyncpg), so a worker keeps serving
+other requests during every round trip, and the favorites of a user are read
+with concurrent queries. Every other request, including the NDJSON streams,
+goes to the Flask app on a pool of WSGI_THREADS threads.
+
+The async handlers parse the request and build the response inside a Flask
+request context, so they share the validation, ETags, JSON provider and
+after_request hooks (CORS, metrics) of the sync routes and answer with the
+same bodies.
+
+    $ uvicorn --app-dir src asgi:application --workers 4
+"""
+import asyncio
+import os
+import re
+from a2wsgi import WSGIMiddleware
+from flask import jsonify
+from flask.testing import EnvironBuilder
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from utils import APIException, version_etag, is_not_modified, conditional_response
+from database import async_engine_options, on_connect
+from cache import entity_key, cached_entity, cache_entity, version_select, confirm
+from listing import page_query, list_etag_select, list_etag_for, wants_stream
+from metrics import before_cursor_execute, after_cursor_execute
+from ratelimit import proxied_environ
+from resources import RESOURCES, USER
+from app import create_app, favorites_etag_select, favorites_etag_for
+from models import db, default_scope, User, Planet, Character, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles, row_serializer
+
+# the catalog kinds plus users, with the messages of the sync routes
+SPECS = dict(RESOURCES, user=USER)
+FAVORITES = (
+    ('favorite_planets', 'planet', FavoritePlanets, FavoritePlanets.planet_id, Planet),
+    ('favorite_characters', 'character', FavoriteCharacters, FavoriteCharacters.character_id, Character),
+    ('favorite_vehicles', 'vehicle', FavoriteVehicles, FavoriteVehicles.vehicle_id, Vehicle)
+)
+
+app = create_app()
+
+
+def create_engine():
+    config = async_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    if config is None:
+        return None
+    url, options = config
+    try:
+        engine = create_async_engine(url, **options)
+    except ImportError:
+        app.logger.warning('no async driver for %s, serving every route through WSGI', url.get_backend_name())
+        return None
+    if url.get_backend_name() == 'sqlite':
+        event.listen(engine.sync_engine, 'connect', on_connect('sqlite'))
+    event.listen(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', after_cursor_execute)
+    return engine
+
+
+engine = create_engine()
+
+
+async def fetch_one(stmt):
+    async with engine.connect() as connection:
+        return (await connection.execute(stmt)).one_or_none()
+
+async def fetch_all(stmt):
+    async with engine.connect() as connection:
+        return (await connection.execute(stmt)).all()
+
+def public_columns(model):
+    return [getattr(model, field) for field in model.public_fields]
+
+
+async def list_route(kind):
+    spec = SPECS[kind]
+    model = spec['model']
+    stmt, page = page_query(model)
+    async with engine.connect() as connection:
+        etag = list_etag_for(model, (await connection.execute(list_etag_select(model))).one())
+        if is_not_modified(etag):
+            return conditional_response(etag, None)
+        data, next_cursor = page((await connection.execute(stmt)).all())
+
+    return conditional_response(etag, lambda: (jsonify({
+        'msg': spec['list_msg'],
+        'data': data,
+        'next': next_cursor
+    }), 200))
+
+async def load_entity(model, entity_id):
+    """Same (data, updated_at, version) as cache.get_entity, read with one SELECT"""
+    pk = model.__mapper__.primary_key[0]
+    row = await fetch_one(
+        db.select(*public_columns(model), model.updated_at, model.version).where(pk == entity_id, *default_scope(model))
+    )
+    if row is None:
+        return None
+    return row_serializer(model)(row), row[-2], row[-1]
+
+async def single_route(kind, entity_id):
+    spec = SPECS[kind]
+    model = spec['model']
+    entity_id = int(entity_id)
+    # only the catalog goes through the entity cache
+    if kind in RESOURCES:
+        key = entity_key(model, entity_id)
+        found, unconfirmed = cached_entity(key)
+        if unconfirmed:
+            found = confirm(key, found, (await fetch_one(version_select(model, entity_id)) or (None,))[0])
+        if found is None:
+            found = await load_entity(model, entity_id)
+            if found is not None:
+                cache_entity(key, *found)
+    else:
+        found = await load_entity(model, entity_id)
+    if found is None:
+        return jsonify({'msg': spec['missing_msg'].format(entity_id)}), 404
+
+    data, updated_at, version = found
+    return conditional_response(version_etag(kind, entity_id, version), lambda: (jsonify({
+        'msg': spec['single_msg'],
+        'data': data
+    }), 200), updated_at)
+
+async def favorites_route(id_user):
+    id_user = int(id_user)
+    etag = favorites_etag_for(id_user, await fetch_one(favorites_etag_select(id_user)))
+    if etag is None:
+        return jsonify({'msg': USER['missing_msg'].format(id_user)}), 404
+    if is_not_modified(etag):
+        return conditional_response(etag, None)
+
+    # the user and the three favorite tables are independent, read them at the same time
+    queries = [fetch_one(db.select(*public_columns(User)).where(User.id == id_user, *default_scope(User)))]
+    for _, _, favorite, entity_fk, entity in FAVORITES:
+        queries.append(fetch_all(
+            db.select(favorite.id, *public_columns(entity))
+            .join(entity, entity_fk == entity.__mapper__.primary_key[0])
+            .where(favorite.user_id == id_user)
+            .order_by(favorite.id)
+        ))
+    user, *favorites = await asyncio.gather(*queries)
+    if user is None:
+        return jsonify({'msg': USER['missing_msg'].format(id_user)}), 404
+
+    data = {}
+    for (name, kind, _, _, entity), rows in zip(FAVORITES, favorites):
+        serialize = row_serializer(entity)
+        data[name] = [{'id': row[0], kind: serialize(row[1:])} for row in rows]
+    data['user_data'] = row_serializer(User)(user)
+    return conditional_response(etag, lambda: (jsonify({
+        'msg': f'GET all favorites of user with id {id_user}',
+        'data': data
+    }), 200))
+
+
+ROUTES = (
+    (re.compile(r'/(user|planet|character|vehicle)/?'), list_route),
+    (re.compile(r'/(user|planet|character|vehicle)/(\d+)/?'), single_route),
+    (re.compile(r'/user/(\d+)/favorites/?'), favorites_route)
+)
+
+
+async def dispatch(scope, handler, args):
+    """Runs an async handler inside a Flask request context, None means fall back to WSGI"""
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    environ = {'REMOTE_ADDR': scope['client'][0]} if scope.get('client') else {}
+    builder = EnvironBuilder(app, scope['path'], method=scope['method'], headers=headers,
+                             query_string=scope['query_string'], environ_base=environ)
+    # the same client address the WSGI routes get behind RATELIMIT_TRUSTED_PROXIES
+    with app.request_context(proxied_environ(app, builder.get_environ())):
+        # before the before_request hooks, so the WSGI fallback is not rate limited a second time
+        if handler is list_route and wants_stream():
+            return None
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await handler(*args)
+                if rv is None:
+                    return None
+        except APIException as error:
+            rv = jsonify(error.to_dict()), error.status_code
+        return app.process_response(app.make_response(rv))
+
+async def send_response(send, response, head):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': b'' if head else response.get_data()})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if engine is not None:
+                await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+wsgi_application = WSGIMiddleware(app, workers=int(os.getenv('WSGI_THREADS', 10)))
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and engine is not None and scope['method'] in ('GET', 'HEAD'):
+        for pattern, handler in ROUTES:
+            match = pattern.fullmatch(scope['path'])
+            if match:
+                response = await dispatch(scope, handler, match.groups())
+                if response is not None:
+                    return await send_response(send, response, scope['method'] == 'HEAD')
+                break
+    await wsgi_application(scope, receive, send)
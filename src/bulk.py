@@ -0,0 +1,216 @@
+"""
+Batch create, update and delete for planets, characters and vehicles.
+
+A batch is checked with one IN query per constraint and written with a single
+executemany inside one transaction, instead of a SELECT and a commit per item.
+"""
+import json
+from flask import request
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from utils import APIException
+from cache import invalidate
+from favorites import delete_favorites_of
+from leaderboard import entities_deleted
+from search import index_name, unindex_name
+from resources import RESOURCES, coerce_values
+from models import db, fits_integer
+
+MAX_BATCH = 10000
+IN_CHUNK = 500
+
+
+def read_items():
+    """Reads a JSON array, or one JSON document per line for application/x-ndjson"""
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise APIException(f'Invalid JSON in line {len(items) + 1}')
+    else:
+        items = request.get_json(silent=True)
+
+    if not isinstance(items, list) or not items:
+        raise APIException('You must send a JSON array or NDJSON lines in the body')
+    if len(items) > MAX_BATCH:
+        raise APIException(f'A batch can have at most {MAX_BATCH} items')
+    return items
+
+def chunks(values):
+    values = list(values)
+    for start in range(0, len(values), IN_CHUNK):
+        yield values[start:start + IN_CHUNK]
+
+def existing_values(column, values):
+    found = set()
+    for chunk in chunks(values):
+        found.update(db.session.execute(db.select(column).where(column.in_(chunk))).scalars())
+    return found
+
+def name_owners(name_column, pk, names):
+    """{name: id of the row that has it} for the names already taken"""
+    owners = {}
+    for chunk in chunks(names):
+        owners.update(db.session.execute(db.select(name_column, pk).where(name_column.in_(chunk))).all())
+    return owners
+
+def batch_status(results, success):
+    succeeded = sum(1 for result in results if result['status'] == success)
+    if succeeded == len(results):
+        return succeeded, success
+    return succeeded, 207 if succeeded else 400
+
+def commit_batch(spec, write, conflict_msg=None):
+    try:
+        write()
+        db.session.commit()
+    except IntegrityError:
+        # another request inserted one of the names (or a favorite) after our queries
+        db.session.rollback()
+        raise APIException(conflict_msg or spec['exists_msg'], status_code=409)
+
+def update_rows(model, pk_name, rows):
+    """One executemany per set of changed fields, each UPDATE bumping the row version"""
+    pk = getattr(model, pk_name)
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    for fields, group in groups.items():
+        db.session.execute(
+            db.update(model)
+            .where(pk == db.bindparam(f'b_{pk_name}'))
+            .values(**{field: db.bindparam(f'b_{field}') for field in fields if field != pk_name},
+                    version=model.version + 1)
+            .execution_options(synchronize_session=False),
+            [{f'b_{field}': value for field, value in row.items()} for row in group]
+        )
+
+
+def bulk_create(kind):
+    spec = RESOURCES[kind]
+    model, name_field, fields = spec['model'], spec['name'], spec['fields']
+    items = read_items()
+
+    results = [None] * len(items)
+    valid = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not all(field in item for field in fields):
+            results[index] = {'index': index, 'status': 400, 'msg': spec['required_msg']}
+        elif any(field not in fields for field in item):
+            results[index] = {'index': index, 'status': 400, 'msg': spec['allowed_msg']}
+        else:
+            items[index], error = coerce_values(spec, item)
+            if error:
+                results[index] = {'index': index, 'status': 400, 'msg': error}
+            elif items[index][name_field] in valid:
+                results[index] = {'index': index, 'status': 400, 'msg': spec['exists_msg']}
+            else:
+                valid[items[index][name_field]] = index
+
+    for name in existing_values(getattr(model, name_field), valid):
+        index = valid.pop(name)
+        results[index] = {'index': index, 'status': 400, 'msg': spec['exists_msg']}
+
+    if valid:
+        commit_batch(spec, lambda: db.session.execute(insert(model), [items[index] for index in valid.values()]))
+
+        pk = model.__mapper__.primary_key[0]
+        name_column = getattr(model, name_field)
+        for chunk in chunks(valid):
+            for entity_id, name in db.session.execute(db.select(pk, name_column).where(name_column.in_(chunk))):
+                index = valid[name]
+                invalidate(model, entity_id)
+                index_name(kind, entity_id, name)
+                results[index] = {'index': index, 'status': 201, 'msg': f'New {kind} created', 'data': {**items[index], pk.key: entity_id}}
+
+    created, status = batch_status(results, 201)
+    return {'msg': f'{created} of {len(items)} {kind}s created', 'data': results}, status
+
+def bulk_update(kind):
+    spec = RESOURCES[kind]
+    model, name_field, fields = spec['model'], spec['name'], spec['fields']
+    pk_name = model.__mapper__.primary_key[0].key
+    items = read_items()
+
+    results = [None] * len(items)
+    valid = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not fits_integer(model.__table__.c[pk_name], item.get(pk_name)):
+            results[index] = {'index': index, 'status': 400, 'msg': f'Each item must have an integer {pk_name}'}
+        elif any(field not in fields for field in item if field != pk_name):
+            results[index] = {'index': index, 'status': 400, 'msg': f'allowed fields {", ".join(fields[:-1])} and {fields[-1]}'}
+        elif len(item) == 1:
+            results[index] = {'index': index, 'status': 400, 'msg': 'You must send information in the body'}
+        elif item[pk_name] in valid:
+            results[index] = {'index': index, 'status': 400, 'msg': f'{spec["label"]} with id {item[pk_name]} appears more than once'}
+        else:
+            values, error = coerce_values(spec, {field: value for field, value in item.items() if field != pk_name})
+            if error:
+                results[index] = {'index': index, 'status': 400, 'msg': error}
+            else:
+                items[index] = dict(values, **{pk_name: item[pk_name]})
+                valid[item[pk_name]] = index
+
+    found = existing_values(getattr(model, pk_name), valid)
+    for entity_id in set(valid) - found:
+        index = valid.pop(entity_id)
+        results[index] = {'index': index, 'status': 404, 'msg': f'{spec["label"]} with id {entity_id} not found'}
+
+    names = {}
+    for entity_id, index in valid.items():
+        if name_field in items[index]:
+            names.setdefault(items[index][name_field], []).append(entity_id)
+    owners = name_owners(getattr(model, name_field), getattr(model, pk_name), names)
+    for name, entity_ids in names.items():
+        # an item keeping its own name is not a duplicate
+        if len(entity_ids) > 1 or owners.get(name, entity_ids[0]) != entity_ids[0]:
+            for entity_id in entity_ids:
+                index = valid.pop(entity_id)
+                results[index] = {'index': index, 'status': 400, 'msg': spec['exists_msg']}
+
+    if valid:
+        commit_batch(spec, lambda: update_rows(model, pk_name, [items[index] for index in valid.values()]))
+        for entity_id, index in valid.items():
+            invalidate(model, entity_id)
+            if name_field in items[index]:
+                index_name(kind, entity_id, items[index][name_field])
+            results[index] = {'index': index, 'status': 200, 'msg': f'{spec["label"]} with id {entity_id} modified successfully'}
+
+    modified, status = batch_status(results, 200)
+    return {'msg': f'{modified} of {len(items)} {kind}s modified', 'data': results}, status
+
+def bulk_delete(kind):
+    spec = RESOURCES[kind]
+    model = spec['model']
+    pk = model.__mapper__.primary_key[0]
+    items = read_items()
+
+    if not all(fits_integer(pk, item) for item in items):
+        raise APIException(f'You must send a list of {pk.key} values')
+
+    found = existing_values(pk, items)
+
+    def delete():
+        # the favorites go in the same transaction, they would be left pointing to nothing
+        for chunk in chunks(found):
+            delete_favorites_of(kind, chunk)
+            db.session.execute(db.delete(model).where(pk.in_(chunk)).execution_options(synchronize_session=False))
+
+    commit_batch(spec, delete, f'One of the {kind}s was added to favorites while deleting them, try again')
+    entities_deleted(kind, found)
+
+    results = []
+    for index, entity_id in enumerate(items):
+        if entity_id in found:
+            invalidate(model, entity_id)
+            unindex_name(kind, entity_id)
+            results.append({'index': index, 'status': 200, 'msg': f'{spec["label"]} with id {entity_id} delete'})
+        else:
+            results.append({'index': index, 'status': 404, 'msg': f'{spec["label"]} with id {entity_id} not found'})
+
+    deleted, status = batch_status(results, 200)
+    return {'msg': f'{deleted} of {len(items)} {kind}s deleted', 'data': results}, status
@@ -0,0 +1,473 @@
+"""
+Read-through cache for the serialized planets, characters and vehicles.
+
+Entries are stored as JSON bytes under a key that embeds a per-entity version.
+Writes bump the version instead of deleting the entry, so with a backend shared
+between gunicorn workers (mmap or redis) every worker stops reading the old
+entry as soon as one of them commits a change. The memory backend only hears
+about the changes of its own worker, so there a hit older than
+CACHE_CONFIRM_INTERVAL seconds (default 1) is only served after a primary key
+lookup of the row version confirms it, which starts the interval again. Other
+workers' writes can take that long to show; CACHE_CONFIRM_INTERVAL=0 checks
+every hit.
+"""
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+from models import db
+
+
+class LRUCache:
+    """
+    In-process backend, one copy per worker.
+
+    Versions come from one sequence shared by every key, so a key whose
+    version was forgotten never gets back a number it had before. They are
+    kept in bump order and forgotten 2 * ttl after their last bump: by then
+    every entry stored under an earlier version has expired, so the key can
+    safely fall back to version 0 (the ttl again covers a request that read
+    the version just before the bump and stored its entry a little later).
+    """
+    # what one worker stores or bumps is not seen by the others
+    shared = False
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._versions = OrderedDict()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _forget_versions(self, now):
+        while self._versions:
+            key, (_, bumped_at) = next(iter(self._versions.items()))
+            if bumped_at + 2 * self.ttl > now:
+                return
+            del self._versions[key]
+
+    def version(self, key):
+        with self._lock:
+            item = self._versions.get(key)
+            if item is None or item[1] + 2 * self.ttl <= time.monotonic():
+                return 0
+            return item[0]
+
+    def bump(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._forget_versions(now)
+            self._sequence += 1
+            self._versions.pop(key, None)
+            self._versions[key] = (self._sequence, now)
+            return self._sequence
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def after_fork(self):
+        # the copy is inherited, a lock held by another thread of the parent is not released
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'versions': len(self._versions),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class MmapFile:
+    """
+    Memory mapped file shared by the workers of one host, for the backends
+    that keep fixed slots addressed by key hash. _locked() serializes the
+    threads of a worker and takes a flock on the file against the others:
+    exclusive to write, shared to read.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < self.size:
+            os.ftruncate(self._fd, self.size)
+        self._map = mmap.mmap(self._fd, self.size)
+        self._lock = threading.Lock()
+
+    def after_fork(self):
+        # flock belongs to the open file, which a forked worker would share with its parent
+        self._map.close()
+        os.close(self._fd)
+        self._open()
+
+    @staticmethod
+    def _hash(key):
+        # 0 marks an empty slot, so it is never a valid hash
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    @contextmanager
+    def _locked(self, operation):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if operation == 'write' else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class MmapCache(MmapFile):
+    """
+    Backend shared by the workers of one host through a memory mapped file.
+
+    The file holds a table of version counters followed by fixed size entry
+    slots addressed by key hash with short linear probing. Writers take an
+    exclusive flock on the file, readers a shared one.
+    """
+    shared = True
+    SLOT_HEADER = struct.Struct('<QdI')
+    COUNTER = struct.Struct('<Q')
+    PROBES = 4
+
+    def __init__(self, path, slots=4096, slot_size=1024, counters=65536, ttl=300):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.counters = counters
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._counters_size = counters * self.COUNTER.size
+        super().__init__(path, self._counters_size + slots * slot_size)
+
+    def _slot_offset(self, key_hash, probe):
+        return self._counters_size + ((key_hash + probe) % self.slots) * self.slot_size
+
+    def get(self, key):
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._locked('read'):
+            for probe in range(self.PROBES):
+                offset = self._slot_offset(key_hash, probe)
+                slot_hash, expires_at, length = self.SLOT_HEADER.unpack_from(self._map, offset)
+                if slot_hash != key_hash:
+                    continue
+                if expires_at <= now:
+                    self.expirations += 1
+                    break
+                start = offset + self.SLOT_HEADER.size
+                self.hits += 1
+                return bytes(self._map[start:start + length])
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if len(value) > self.slot_size - self.SLOT_HEADER.size:
+            return
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._locked('write'):
+            target = None
+            for probe in range(self.PROBES):
+                offset = self._slot_offset(key_hash, probe)
+                slot_hash, expires_at, _ = self.SLOT_HEADER.unpack_from(self._map, offset)
+                if slot_hash == key_hash or slot_hash == 0 or expires_at <= now:
+                    target = offset
+                    break
+            if target is None:
+                target = self._slot_offset(key_hash, 0)
+                self.evictions += 1
+            self.SLOT_HEADER.pack_into(self._map, target, key_hash, now + self.ttl, len(value))
+            start = target + self.SLOT_HEADER.size
+            self._map[start:start + len(value)] = value
+
+    def delete(self, key):
+        key_hash = self._hash(key)
+        with self._locked('write'):
+            for probe in range(self.PROBES):
+                offset = self._slot_offset(key_hash, probe)
+                if self.SLOT_HEADER.unpack_from(self._map, offset)[0] == key_hash:
+                    self.SLOT_HEADER.pack_into(self._map, offset, 0, 0, 0)
+
+    def _counter_offset(self, key):
+        # colliding keys share a counter, which only costs an extra miss
+        return (self._hash(key) % self.counters) * self.COUNTER.size
+
+    def version(self, key):
+        with self._locked('read'):
+            return self.COUNTER.unpack_from(self._map, self._counter_offset(key))[0]
+
+    def bump(self, key):
+        offset = self._counter_offset(key)
+        with self._locked('write'):
+            version = self.COUNTER.unpack_from(self._map, offset)[0] + 1
+            self.COUNTER.pack_into(self._map, offset, version)
+            return version
+
+    def clear(self):
+        with self._locked('write'):
+            self._map[self._counters_size:] = bytes(self.slots * self.slot_size)
+
+    def stats(self):
+        return {
+            'backend': 'mmap',
+            'path': self.path,
+            'slots': self.slots,
+            'slot_size': self.slot_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+class RedisClient:
+    """
+    Client for any server speaking the redis protocol, with one connection
+    per thread. Connection errors are counted and command() returns None, so
+    callers can carry on without the server.
+    """
+
+    def __init__(self, url, timeout=0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self.errors = 0
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', self.db)
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError('connection closed by server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            raise RuntimeError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            return [self._read_reply() for _ in range(int(payload))]
+        raise ConnectionError(f'unexpected reply {line!r}')
+
+    def _call(self, *args):
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self._local.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def command(self, *args):
+        try:
+            if getattr(self._local, 'sock', None) is None:
+                self._connect()
+            return self._call(*args)
+        except (OSError, ConnectionError, RuntimeError):
+            self.errors += 1
+            self._local.sock = None
+            return None
+
+    def after_fork(self):
+        # a socket inherited from the parent would interleave replies between processes
+        self._local = threading.local()
+
+
+class RedisCache(RedisClient):
+    """
+    Backend shared by every worker through a redis server. Connection errors
+    are treated as misses so the API keeps answering from the database when
+    the server is down.
+    """
+    shared = True
+
+    def __init__(self, url, ttl=300, timeout=0.5):
+        super().__init__(url, timeout)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.command('GET', key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.command('SET', key, value, 'EX', int(self.ttl))
+
+    def delete(self, key):
+        self.command('DEL', key)
+
+    def version(self, key):
+        return int(self.command('GET', key) or 0)
+
+    def bump(self, key):
+        return self.command('INCR', key) or 0
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'host': self.host,
+            'port': self.port,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors
+        }
+
+
+def create_backend():
+    backend = os.getenv('CACHE_BACKEND', 'memory')
+    ttl = float(os.getenv('CACHE_TTL', 300))
+    if backend == 'mmap':
+        return MmapCache(
+            os.getenv('CACHE_MMAP_PATH', '/tmp/starwars-cache.mmap'),
+            slots=int(os.getenv('CACHE_MAXSIZE', 4096)),
+            ttl=ttl
+        )
+    if backend == 'redis':
+        return RedisCache(os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0'), ttl=ttl)
+    return LRUCache(maxsize=int(os.getenv('CACHE_MAXSIZE', 1024)), ttl=ttl)
+
+
+catalog_cache = create_backend()
+CONFIRM_INTERVAL = float(os.getenv('CACHE_CONFIRM_INTERVAL', 1))
+
+
+def _version_key(model, entity_id):
+    return f'version:{model.__tablename__}:{entity_id}'
+
+def entity_key(model, entity_id):
+    version = catalog_cache.version(_version_key(model, entity_id))
+    return f'{model.__tablename__}:{entity_id}:{version}'
+
+def cached_entity(key):
+    """The cached (data, updated_at, version), or None, and whether it must be confirmed before it is served"""
+    data = catalog_cache.get(key)
+    if data is None:
+        return None, False
+    entry = json.loads(data)
+    if 'version' not in entry:
+        # written before entries carried the row version
+        return None, False
+    cached = entry['data'], datetime.fromisoformat(entry['updated_at']), entry['version']
+    # confirmed_at is this worker's clock, only the memory backend reads it
+    return cached, not catalog_cache.shared and time.monotonic() - entry.get('confirmed_at', 0) > CONFIRM_INTERVAL
+
+def cache_entity(key, data, updated_at, version):
+    catalog_cache.set(key, json.dumps({
+        'data': data,
+        'updated_at': updated_at.isoformat(),
+        'version': version,
+        'confirmed_at': time.monotonic()
+    }).encode())
+    return data, updated_at, version
+
+def version_select(model, entity_id):
+    return db.select(model.version).where(model.__mapper__.primary_key[0] == entity_id)
+
+def confirm(key, cached, current_version):
+    """The cached entry, trusted for another interval, if the row still has its version; None when outdated or gone"""
+    if cached[2] != current_version:
+        return None
+    return cache_entity(key, *cached)
+
+def get_entity(model, entity_id):
+    """
+    Returns the serialized entity, its last update time and its row version,
+    loading them from the database on a miss, or None if the entity does not
+    exist.
+    """
+    key = entity_key(model, entity_id)
+    cached, unconfirmed = cached_entity(key)
+    if unconfirmed:
+        cached = confirm(key, cached, db.session.execute(version_select(model, entity_id)).scalar())
+    if cached is not None:
+        return cached
+
+    entity = model.query.get(entity_id)
+    if entity is None:
+        return None
+    return cache_entity(key, entity.serialize(), entity.updated_at, entity.version)
+
+def invalidate(model, entity_id):
+    catalog_cache.bump(_version_key(model, entity_id))
@@ -0,0 +1,77 @@
+"""
+Maintenance commands, run with the flask CLI:
+
+    $ flask favorites reconcile
+    $ flask users purge --days 90
+    $ flask catalog export planet planets.ndjson
+    $ flask catalog import planet planets.ndjson --resume
+"""
+import time
+import click
+from flask.cli import AppGroup
+from archive import purge_inactive_users
+from resources import RESOURCES
+from favorites import FAVORITE_KINDS, reconcile_counts
+from transfer import FORMATS, CHUNK, TransferError, import_file, export_file
+
+favorites_cli = AppGroup('favorites', help='Favorite counters.')
+users_cli = AppGroup('users', help='User accounts.')
+catalog_cli = AppGroup('catalog', help='Planets, characters and vehicles as NDJSON or CSV files.')
+
+
+@favorites_cli.command('reconcile')
+@click.option('--kind', type=click.Choice(list(FAVORITE_KINDS)), multiple=True, help='Defaults to every kind.')
+@click.option('--batch', default=10000, show_default=True, help='Primary keys per transaction.')
+def reconcile(kind, batch):
+    """Recompute favorite_count of planets, characters and vehicles."""
+    for name in kind or FAVORITE_KINDS:
+        fixed = reconcile_counts(name, batch)
+        click.echo(f'{name}: {fixed} counters fixed')
+
+@users_cli.command('purge')
+@click.option('--days', default=90, show_default=True, help='Archive users deactivated more than this many days ago.')
+@click.option('--batch', default=1000, show_default=True, help='Users per transaction.')
+def purge(days, batch):
+    """Move long deactivated users and their favorites to the archive tables."""
+    click.echo(f'{purge_inactive_users(days, batch)} users archived')
+
+def show_progress(kind, verb):
+    last = 0
+
+    def progress(rows, done, rate):
+        # at most one line a second
+        nonlocal last
+        if time.monotonic() - last >= 1 or done >= 1:
+            last = time.monotonic()
+            click.echo(f'{kind}: {rows} rows {verb}, {done:.0%}, {rate:.0f} rows/s', err=True)
+    return progress
+
+@catalog_cli.command('import')
+@click.argument('kind', type=click.Choice(list(RESOURCES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to csv for .csv files, ndjson otherwise.')
+@click.option('--chunk', default=CHUNK, show_default=True, help='Rows per transaction.')
+@click.option('--resume', is_flag=True, help='Continue after the last chunk a failed run committed.')
+def import_catalog(kind, path, fmt, chunk, resume):
+    """Insert the rows of an NDJSON or CSV file."""
+    try:
+        imported = import_file(kind, path, fmt, chunk, resume, show_progress(kind, 'imported'))
+    except TransferError as error:
+        raise click.ClickException(str(error))
+    click.echo(f'{kind}: {imported} rows imported')
+
+@catalog_cli.command('export')
+@click.argument('kind', type=click.Choice(list(RESOURCES)))
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to csv for .csv files, ndjson otherwise.')
+@click.option('--chunk', default=CHUNK, show_default=True, help='Rows fetched at a time.')
+def export_catalog(kind, path, fmt, chunk):
+    """Write every row, ordered by id, to an NDJSON or CSV file."""
+    exported = export_file(kind, path, fmt, chunk, show_progress(kind, 'exported'))
+    click.echo(f'{kind}: {exported} rows exported')
+
+
+def setup_commands(app):
+    app.cli.add_command(favorites_cli)
+    app.cli.add_command(users_cli)
+    app.cli.add_command(catalog_cli)
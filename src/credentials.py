@@ -0,0 +1,108 @@
+"""
+Password hashing with scrypt on a bounded worker pool.
+
+Hashes are stored as scrypt$n$r$p$salt$hash. The cost comes from
+PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R and PASSWORD_SCRYPT_P; a stored hash made
+with other parameters, or a plaintext password from before hashing, is
+replaced on the next successful login.
+
+At most PASSWORD_WORKERS hashes run at the same time, on threads (scrypt
+releases the GIL) or processes with PASSWORD_POOL=process, and at most
+PASSWORD_QUEUE more wait for a worker. A request that cannot get its hash
+within PASSWORD_TIMEOUT seconds is answered with 503, so a burst of signups
+uses a fixed share of the CPU instead of slowing every other endpoint down.
+The pool only adds concurrency on threaded workers (gthread, the default in
+gunicorn.conf.py, or the ASGI thread pool): a sync worker blocks on its one
+request for the whole hash either way.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError
+from utils import APIException
+
+SCHEME = 'scrypt'
+KEY_LENGTH = 32
+SALT_LENGTH = 16
+
+
+def cost():
+    return (
+        int(os.getenv('PASSWORD_SCRYPT_N', 2 ** 15)),
+        int(os.getenv('PASSWORD_SCRYPT_R', 8)),
+        int(os.getenv('PASSWORD_SCRYPT_P', 1))
+    )
+
+def _b64(raw):
+    return base64.b64encode(raw).decode()
+
+def _derive(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p + 2 ** 20, dklen=KEY_LENGTH)
+
+def _hash(password, n, r, p):
+    salt = os.urandom(SALT_LENGTH)
+    return f'{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(_derive(password, salt, n, r, p))}'
+
+def _verify(password, stored):
+    _, n, r, p, salt, expected = stored.split('$')
+    derived = _derive(password, base64.b64decode(salt), int(n), int(r), int(p))
+    return hmac.compare_digest(derived, base64.b64decode(expected))
+
+def is_hashed(stored):
+    return stored.startswith(SCHEME + '$') and stored.count('$') == 5
+
+def needs_rehash(stored):
+    return not is_hashed(stored) or tuple(map(int, stored.split('$')[1:4])) != cost()
+
+
+class PasswordPool:
+    def __init__(self, workers, queue, timeout, processes=False):
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.executor = executor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.timeout = timeout
+
+    def run(self, fn, *args):
+        deadline = time.monotonic() + self.timeout
+        if not self.slots.acquire(timeout=self.timeout):
+            raise APIException('Too many password operations in progress, try again later', 503)
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=max(0, deadline - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            raise APIException('Password operation timed out, try again later', 503)
+
+
+pool = PasswordPool(
+    workers=int(os.getenv('PASSWORD_WORKERS', 2)),
+    queue=int(os.getenv('PASSWORD_QUEUE', 32)),
+    timeout=float(os.getenv('PASSWORD_TIMEOUT', 5)),
+    processes=os.getenv('PASSWORD_POOL', 'thread') == 'process'
+)
+# verified when the user does not exist, so unknown users take as long as wrong passwords
+_dummy_hash = None
+
+
+def hash_password(password):
+    return pool.run(_hash, password, *cost())
+
+def verify_password(password, stored):
+    """
+    Returns whether `password` matches the stored value, hashed or legacy
+    plaintext. None as `stored` still costs one hash.
+    """
+    global _dummy_hash
+    if stored is None:
+        if _dummy_hash is None:
+            _dummy_hash = hash_password('')
+        pool.run(_verify, password, _dummy_hash)
+        return False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    return pool.run(_verify, password, stored)
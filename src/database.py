@@ -0,0 +1,111 @@
+"""
+Engine configuration from the environment.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT   connection pool bounds
+    DB_POOL_PRE_PING                                 test connections on checkout (default on for servers)
+    DB_POOL_RECYCLE                                  seconds before a connection is replaced
+    DB_STATEMENT_TIMEOUT_MS                          server side statement timeout (postgres, mysql)
+
+SQLite files get a persistent pool too, and every new connection is set up
+with the SQLITE_JOURNAL_MODE (WAL), SQLITE_SYNCHRONOUS (NORMAL),
+SQLITE_BUSY_TIMEOUT_MS and SQLITE_MMAP_SIZE pragmas, so readers do not wait
+for writers and writers wait for each other instead of failing with
+"database is locked".
+"""
+import os
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+DEFAULT_URL = 'sqlite:////tmp/test.db'
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite', 'mysql': 'aiomysql'}
+
+
+def env_int(name, default):
+    value = os.getenv(name)
+    return default if value in (None, '') else int(value)
+
+def env_bool(name, default):
+    value = os.getenv(name)
+    return default if value in (None, '') else value.lower() in ('1', 'true', 'yes', 'on')
+
+def database_url():
+    return os.getenv('DATABASE_URL', DEFAULT_URL).replace('postgres://', 'postgresql://')
+
+def is_sqlite_file(url):
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+def engine_options(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == 'sqlite' and not is_sqlite_file(url):
+        # in-memory databases keep the single shared connection Flask-SQLAlchemy sets up
+        return {}
+
+    options = {
+        'pool_size': env_int('DB_POOL_SIZE', 5),
+        'max_overflow': env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': env_bool('DB_POOL_PRE_PING', backend != 'sqlite')
+    }
+    if backend == 'sqlite':
+        options['poolclass'] = QueuePool
+        options['connect_args'] = {'check_same_thread': False}
+
+    timeout = env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if timeout and backend == 'postgresql' and url.get_driver_name() in ('psycopg2', 'psycopg'):
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    return options
+
+def sqlite_pragmas():
+    return (
+        ('journal_mode', os.getenv('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('busy_timeout', env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        ('mmap_size', env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    )
+
+def on_connect(backend):
+    pragmas = sqlite_pragmas()
+    timeout = env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+
+    def configure(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if backend == 'sqlite':
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name}={value}')
+        elif backend == 'mysql':
+            cursor.execute(f'SET SESSION max_execution_time={timeout}')
+        cursor.close()
+    return configure
+
+def async_engine_options(url):
+    """
+    URL and engine options for the async driver of the same database, or None
+    when there is no async driver or the database only lives in memory.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS or (backend == 'sqlite' and not is_sqlite_file(url)):
+        return None
+
+    options = engine_options(url.set(drivername=backend))
+    if options.get('poolclass') is QueuePool:
+        options['poolclass'] = AsyncAdaptedQueuePool
+    timeout = env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if timeout and backend == 'postgresql':
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(timeout)}}
+    return url.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}'), options
+
+def setup_database(app, db):
+    # a url or options passed to create_app win over the environment
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_url())
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(url))
+    db.init_app(app)
+
+    backend = url.get_backend_name()
+    if backend == 'sqlite' or (backend == 'mysql' and env_int('DB_STATEMENT_TIMEOUT_MS', 0)):
+        with app.app_context():
+            event.listen(db.engine, 'connect', on_connect(backend))
@@ -0,0 +1,258 @@
+"""
+Write path for the favorite tables.
+
+Adding a favorite is a single INSERT ... SELECT that only produces a row when
+the user and the entity exist, and the unique (user_id, entity_id) index turns
+duplicates into no-ops. Removing one is a single DELETE. The affected row count
+tells the happy path apart; only failed calls run a second query to pick the
+right 404 or 400 message.
+
+Every change also moves favorite_count on the planet, character or vehicle in
+the same transaction, and feeds the new counts to the leaderboards.
+"""
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from utils import APIException
+from leaderboard import favorites_changed, counts_reconciled
+from models import db, default_scope, fits_integer, User, Planet, Character, Vehicle, FavoritePlanets, FavoriteCharacters, FavoriteVehicles
+
+MAX_BATCH = 1000
+FAVORITE_KINDS = {
+    'planet': {
+        'model': FavoritePlanets,
+        'column': 'planet_id',
+        'entity': Planet,
+        'missing_msg': 'The planet does not exist',
+        'duplicate_msg': 'Planet is already a favorite',
+        'added_msg': 'Planet added to favorites',
+        'label': 'Planet'
+    },
+    'character': {
+        'model': FavoriteCharacters,
+        'column': 'character_id',
+        'entity': Character,
+        'missing_msg': 'The character does not exist',
+        'duplicate_msg': 'character is already a favorite',
+        'added_msg': 'character added to favorites',
+        'label': 'Character'
+    },
+    'vehicle': {
+        'model': FavoriteVehicles,
+        'column': 'vehicle_id',
+        'entity': Vehicle,
+        'missing_msg': 'The vehicle does not exist',
+        'duplicate_msg': 'Vehicle is already a favorite',
+        'added_msg': 'Vehicle added to favorites',
+        'label': 'Vehicle'
+    }
+}
+
+
+def insert_ignore_from_select(model, columns, select_stmt):
+    """
+    Runs INSERT INTO model (columns) SELECT ... skipping rows that violate a
+    unique index. Returns the number of inserted rows.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(model).from_select(columns, select_stmt).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(model).from_select(columns, select_stmt).on_conflict_do_nothing()
+    elif dialect == 'mysql':
+        stmt = insert(model).from_select(columns, select_stmt).prefix_with('IGNORE')
+    else:
+        try:
+            with db.session.begin_nested():
+                return db.session.execute(insert(model).from_select(columns, select_stmt)).rowcount
+        except IntegrityError:
+            return 0
+    return db.session.execute(stmt).rowcount
+
+def entity_pk(kind):
+    entity = FAVORITE_KINDS[kind]['entity']
+    return getattr(entity, FAVORITE_KINDS[kind]['column'])
+
+def favorite_counts(kind, entity_ids):
+    pk = entity_pk(kind)
+    entity = FAVORITE_KINDS[kind]['entity']
+    return dict(db.session.execute(db.select(pk, entity.favorite_count).where(pk.in_(entity_ids))).all())
+
+def set_counts(kind, entity_ids, value):
+    """
+    UPDATE of favorite_count to `value` for the given entities, leaving
+    updated_at alone so catalog ETags do not change. Returns the new counts.
+    """
+    if not entity_ids:
+        return {}
+    entity = FAVORITE_KINDS[kind]['entity']
+    pk = entity_pk(kind)
+    stmt = (
+        db.update(entity)
+        .where(pk.in_(entity_ids))
+        .values(favorite_count=value, updated_at=entity.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.get_bind().dialect.full_returning:
+        return dict(db.session.execute(stmt.returning(pk, entity.favorite_count)).all())
+    db.session.execute(stmt)
+    return favorite_counts(kind, entity_ids)
+
+def adjust_counts(kind, entity_ids, delta):
+    entity = FAVORITE_KINDS[kind]['entity']
+    return set_counts(kind, entity_ids, entity.favorite_count + delta)
+
+def counted(kind):
+    """Correlated count of the favorites of each entity"""
+    spec = FAVORITE_KINDS[kind]
+    favorite = spec['model']
+    return (
+        db.select(db.func.count(favorite.id))
+        .where(getattr(favorite, spec['column']) == entity_pk(kind))
+        .scalar_subquery()
+    )
+
+def recount(kind, entity_ids):
+    return set_counts(kind, entity_ids, counted(kind))
+
+def reconcile_counts(kind, batch=10000):
+    """
+    Recomputes favorite_count from the favorite table for every entity of
+    `kind`, one primary key range per transaction. Returns how many were wrong.
+    """
+    entity = FAVORITE_KINDS[kind]['entity']
+    pk = entity_pk(kind)
+    low, high = db.session.execute(db.select(db.func.min(pk), db.func.max(pk))).one()
+    fixed = 0
+    for start in range(low or 0, (high or -1) + 1, batch):
+        fixed += db.session.execute(
+            db.update(entity)
+            .where(pk >= start, pk < start + batch, entity.favorite_count != counted(kind))
+            .values(favorite_count=counted(kind), updated_at=entity.updated_at)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    counts_reconciled(kind)
+    return fixed
+
+def delete_favorites_of(kind, entity_ids):
+    """Deletes every favorite of the given entities, in the transaction that deletes them"""
+    spec = FAVORITE_KINDS[kind]
+    model = spec['model']
+    db.session.execute(
+        db.delete(model)
+        .where(getattr(model, spec['column']).in_(entity_ids))
+        .execution_options(synchronize_session=False)
+    )
+
+def exists(user_id, kind, entity_id):
+    """One query telling whether the user and the entity exist"""
+    return db.session.execute(db.select(
+        db.select(User.id).where(User.id == user_id, *default_scope(User)).exists(),
+        db.select(entity_pk(kind)).where(entity_pk(kind) == entity_id).exists()
+    )).one()
+
+
+def add_favorite(kind, user_id, entity_id):
+    spec = FAVORITE_KINDS[kind]
+    source = (
+        db.select(User.id, entity_pk(kind))
+        .join(spec['entity'], db.true())
+        .where(User.id == user_id, entity_pk(kind) == entity_id, *default_scope(User))
+    )
+    added = insert_ignore_from_select(spec['model'], ['user_id', spec['column']], source)
+    counts = adjust_counts(kind, [entity_id], 1) if added else {}
+    db.session.commit()
+    if added:
+        favorites_changed(kind, counts)
+        return {'msg': spec['added_msg']}, 201
+
+    user_exists, entity_exists = exists(user_id, kind, entity_id)
+    if not user_exists:
+        return {'msg': 'The user does not exist'}, 404
+    if not entity_exists:
+        return {'msg': spec['missing_msg']}, 404
+    return {'msg': spec['duplicate_msg']}, 400
+
+def delete_favorite(kind, user_id, entity_id):
+    spec = FAVORITE_KINDS[kind]
+    model = spec['model']
+    removed = db.session.execute(
+        db.delete(model)
+        .where(model.user_id == user_id, getattr(model, spec['column']) == entity_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    counts = adjust_counts(kind, [entity_id], -1) if removed else {}
+    db.session.commit()
+    if removed:
+        favorites_changed(kind, counts)
+        return {'msg': f'Favorite {kind} deleted'}, 200
+
+    user_exists, entity_exists = exists(user_id, kind, entity_id)
+    if not user_exists:
+        return {'msg': 'User not found'}, 404
+    if not entity_exists:
+        return {'msg': f'{spec["label"]} not found'}, 404
+    return {'msg': f'Favorite {kind} not found'}, 404
+
+def parse_batch(body):
+    if not isinstance(body, dict) or not body or any(action not in ('add', 'remove') for action in body):
+        raise APIException('You must send add and/or remove objects in the body')
+    for action, kinds in body.items():
+        if not isinstance(kinds, dict) or any(kind not in FAVORITE_KINDS for kind in kinds):
+            raise APIException(f'{action} must map planet, character or vehicle to a list of ids')
+        for kind, ids in kinds.items():
+            if not isinstance(ids, list) or not all(fits_integer(entity_pk(kind), entity_id) for entity_id in ids):
+                raise APIException(f'{action} must map planet, character or vehicle to a list of ids')
+    if sum(len(ids) for kinds in body.values() for ids in kinds.values()) > MAX_BATCH:
+        raise APIException(f'A batch can have at most {MAX_BATCH} ids')
+    return body.get('add', {}), body.get('remove', {})
+
+def update_favorites(user_id, body):
+    """
+    Adds and removes many favorites of one user in one transaction, with one
+    statement per favorite kind and action. Unknown entities and favorites
+    that already exist are counted as ignored.
+    """
+    to_add, to_remove = parse_batch(body)
+    if not db.session.execute(db.select(db.select(User.id).where(User.id == user_id, *default_scope(User)).exists())).scalar():
+        return {'msg': 'The user does not exist'}, 404
+
+    added, removed, changed = {}, {}, []
+    for kind, ids in to_add.items():
+        spec = FAVORITE_KINDS[kind]
+        model, pk = spec['model'], entity_pk(kind)
+        ids = set(ids)
+        if not ids:
+            added[kind] = {'added': 0, 'ignored': 0}
+            continue
+        already = db.select(model.id).where(model.user_id == user_id, getattr(model, spec['column']) == pk).exists()
+        new_ids = db.session.execute(db.select(pk).where(pk.in_(ids), ~already)).scalars().all()
+        source = db.select(db.literal(user_id), pk).where(pk.in_(ids))
+        count = insert_ignore_from_select(model, ['user_id', spec['column']], source)
+        # a concurrent add of the same favorite makes the expected ids wrong, count them instead
+        changed.append((kind, adjust_counts(kind, new_ids, 1) if count == len(new_ids) else recount(kind, new_ids)))
+        added[kind] = {'added': count, 'ignored': len(ids) - count}
+    for kind, ids in to_remove.items():
+        model = FAVORITE_KINDS[kind]['model']
+        column = getattr(model, FAVORITE_KINDS[kind]['column'])
+        ids = set(ids)
+        if not ids:
+            removed[kind] = {'removed': 0, 'ignored': 0}
+            continue
+        gone = db.session.execute(db.select(column).where(model.user_id == user_id, column.in_(ids))).scalars().all()
+        count = db.session.execute(
+            db.delete(model)
+            .where(model.user_id == user_id, column.in_(ids))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        changed.append((kind, adjust_counts(kind, gone, -1) if count == len(gone) else recount(kind, gone)))
+        removed[kind] = {'removed': count, 'ignored': len(ids) - count}
+    db.session.commit()
+    for kind, counts in changed:
+        favorites_changed(kind, counts)
+
+    return {
+        'msg': f'Favorites of user with id {user_id} updated',
+        'data': {'add': added, 'remove': removed}
+    }, 200
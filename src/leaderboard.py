@@ -0,0 +1,162 @@
+"""
+Most favorited planets, characters and vehicles.
+
+Each worker keeps, per kind, the 2 * LEADERBOARD_MAX_LIMIT entities with the
+highest favorite_count in a sorted list, updated with the new counts every
+time a favorite is added or removed, so reading the top K is a slice. Entities
+outside the list are only known to rank below `ceiling`; when the K-th entry no
+longer ranks above it (removals pushed it down) the list is refilled with one
+index scan. Favorite changes bump a generation counter in the catalog cache,
+so with a shared cache backend a worker notices the changes made by others and
+refills, at most once every LEADERBOARD_REFRESH_INTERVAL seconds. The memory
+backend cannot tell a worker about the others, so there every worker refills
+from the database every LEADERBOARD_REFRESH_INTERVAL seconds.
+"""
+import os
+import threading
+import time
+from bisect import insort
+from cache import catalog_cache, get_entity
+from models import db, Planet, Character, Vehicle
+
+MAX_LIMIT = int(os.getenv('LEADERBOARD_MAX_LIMIT', 100))
+BOARDS = {
+    'planet': (Planet, 'planet_id'),
+    'character': (Character, 'character_id'),
+    'vehicle': (Vehicle, 'vehicle_id')
+}
+
+
+class TopK:
+    """Entities ranked by (count, id), highest first"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._keys = []
+        self._counts = {}
+        self.ceiling = None
+        self._lock = threading.Lock()
+
+    def fill(self, rows, complete):
+        with self._lock:
+            self._counts = dict(rows)
+            self._keys = sorted((count, entity_id) for entity_id, count in self._counts.items())
+            # anything not fetched ranks at most like the last fetched row
+            self.ceiling = None if complete or not self._keys else self._keys[0]
+
+    def _raise_ceiling(self, key):
+        if self.ceiling is None or key > self.ceiling:
+            self.ceiling = key
+
+    def update(self, entity_id, count):
+        key = (count, entity_id)
+        with self._lock:
+            if entity_id in self._counts:
+                self._keys.remove((self._counts.pop(entity_id), entity_id))
+            elif self._keys and len(self._keys) >= self.capacity and key < self._keys[0]:
+                self._raise_ceiling(key)
+                return
+            insort(self._keys, key)
+            self._counts[entity_id] = count
+            if len(self._keys) > self.capacity:
+                evicted = self._keys.pop(0)
+                del self._counts[evicted[1]]
+                self._raise_ceiling(evicted)
+
+    def remove(self, entity_id):
+        with self._lock:
+            if entity_id in self._counts:
+                self._keys.remove((self._counts.pop(entity_id), entity_id))
+
+    def top(self, limit):
+        """The `limit` best (id, count) pairs, or None when the list cannot vouch for them"""
+        with self._lock:
+            if len(self._keys) < limit:
+                return None if self.ceiling is not None else [(entity_id, count) for count, entity_id in reversed(self._keys)]
+            best = self._keys[-limit:]
+            if self.ceiling is not None and best[0] <= self.ceiling:
+                return None
+            return [(entity_id, count) for count, entity_id in reversed(best)]
+
+
+class Leaderboard:
+    def __init__(self, kind, refresh_interval):
+        self.model, pk = BOARDS[kind]
+        self.pk = getattr(self.model, pk)
+        self.generation_key = f'version:leaderboard:{kind}'
+        self.board = TopK(2 * MAX_LIMIT)
+        self.refresh_interval = refresh_interval
+        self.generation = None
+        self.filled_at = 0
+
+    def _fill(self):
+        # read before the scan, so a change made during it is noticed on the next check
+        generation = catalog_cache.version(self.generation_key)
+        count = self.model.favorite_count
+        rows = db.session.execute(
+            db.select(self.pk, count).order_by(count.desc(), self.pk.desc()).limit(self.board.capacity)
+        ).all()
+        self.board.fill(rows, complete=len(rows) < self.board.capacity)
+        self.generation = generation
+        self.filled_at = time.monotonic()
+
+    def _outdated(self):
+        if time.monotonic() - self.filled_at <= self.refresh_interval:
+            return False
+        # the memory backend only counts this worker's changes
+        return not catalog_cache.shared or catalog_cache.version(self.generation_key) != self.generation
+
+    def top(self, limit):
+        if self.generation is None or self._outdated():
+            self._fill()
+        top = self.board.top(limit)
+        if top is None:
+            self._fill()
+            top = self.board.top(limit)
+        return top
+
+    def changed(self, counts):
+        """Applies {entity_id: new favorite_count} after a committed change"""
+        if self.generation is not None:
+            for entity_id, count in counts.items():
+                self.board.update(entity_id, count)
+        generation = catalog_cache.bump(self.generation_key)
+        if self.generation is not None and generation == self.generation + 1:
+            self.generation = generation
+
+    def stale(self):
+        self.generation = None
+
+
+leaderboards = {
+    kind: Leaderboard(kind, float(os.getenv('LEADERBOARD_REFRESH_INTERVAL', 5)))
+    for kind in BOARDS
+}
+
+
+def most_favorited(kind, limit):
+    """The `limit` most favorited entities as their serialized data plus favorite_count"""
+    leaderboard = leaderboards[kind]
+    results = []
+    for entity_id, count in leaderboard.top(limit):
+        found = get_entity(leaderboard.model, entity_id)
+        if found is None:
+            # deleted since it was ranked
+            leaderboard.board.remove(entity_id)
+            continue
+        results.append(dict(found[0], favorite_count=count))
+    return results
+
+def favorites_changed(kind, counts):
+    if counts:
+        leaderboards[kind].changed(counts)
+
+def entities_deleted(kind, entity_ids):
+    leaderboard = leaderboards[kind]
+    for entity_id in entity_ids:
+        leaderboard.board.remove(entity_id)
+    catalog_cache.bump(leaderboard.generation_key)
+
+def counts_reconciled(kind):
+    catalog_cache.bump(leaderboards[kind].generation_key)
+    leaderboards[kind].stale()
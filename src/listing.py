@@ -0,0 +1,233 @@
+"""
+Keyset pagination, filtering, sorting, column projection and NDJSON streaming
+for the list endpoints.
+
+Filters are query parameters named after a public column, optionally with an
+operator suffix: climate=arid, diameter__gte=1000, gender__in=male,female.
+sort takes a comma separated list of columns, prefixed with - for descending.
+"""
+import base64
+import json
+import operator
+from flask import request, current_app, Response, stream_with_context
+from sqlalchemy import and_, or_, func
+from utils import APIException, etag_for
+from models import db, row_serializer, default_scope, integer_bounds, fits_integer
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+STREAM_BATCH = 1000
+RESERVED_PARAMS = frozenset(('limit', 'after', 'fields', 'sort', 'stream'))
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'in': None
+}
+
+
+def primary_key(model):
+    return model.__mapper__.primary_key[0]
+
+def parse_limit():
+    raw = request.args.get('limit')
+    if raw is None:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_LIMIT:
+        raise APIException(f'limit must be an integer between 1 and {MAX_LIMIT}')
+    return limit
+
+def parse_fields(model):
+    # the primary key is always selected because it is the pagination cursor
+    raw = request.args.get('fields')
+    if not raw:
+        return model.public_fields
+
+    requested = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in model.public_fields]
+    if unknown:
+        raise APIException(f'Unknown fields {", ".join(unknown)}, allowed fields {", ".join(model.public_fields)}')
+
+    pk_name = primary_key(model).key
+    fields = [pk_name] + [field for field in requested if field != pk_name]
+    return tuple(dict.fromkeys(fields))
+
+def coerce(model, field, raw):
+    python_type = model.__table__.c[field].type.python_type
+    if python_type is bool:
+        if raw not in ('true', 'false'):
+            raise APIException(f'{field} must be true or false')
+        return raw == 'true'
+    if python_type is int:
+        low, high = integer_bounds(model.__table__.c[field])
+        try:
+            value = int(raw)
+        except ValueError:
+            value = None
+        # beyond the column type sqlite overflows and postgres raises DataError
+        if value is None or not low <= value <= high:
+            raise APIException(f'{field} must be an integer')
+        return value
+    return raw
+
+def parse_filters(model):
+    conditions = []
+    for key, raw in request.args.items(multi=True):
+        if key in RESERVED_PARAMS:
+            continue
+        field, _, name = key.partition('__')
+        if field not in model.public_fields or (name or 'eq') not in OPERATORS:
+            raise APIException(f'Unknown filter {key}, filter on {", ".join(model.public_fields)} with __ne, __gt, __gte, __lt, __lte or __in')
+
+        column = getattr(model, field)
+        if name == 'in':
+            conditions.append(column.in_([coerce(model, field, value) for value in raw.split(',')]))
+        else:
+            conditions.append(OPERATORS[name or 'eq'](column, coerce(model, field, raw)))
+    return conditions
+
+def parse_sort(model):
+    """Returns the ordering as (column, descending) pairs ending with the primary key"""
+    pk = getattr(model, primary_key(model).key)
+    keys = []
+    for item in request.args.get('sort', '').split(','):
+        field = item.strip().lstrip('-')
+        if not field:
+            continue
+        if field not in model.public_fields:
+            raise APIException(f'Unknown sort field {field}, allowed fields {", ".join(model.public_fields)}')
+        keys.append((getattr(model, field), item.strip().startswith('-')))
+        if field == pk.key:
+            return keys
+    return keys + [(pk, False)]
+
+def is_pk_order(keys):
+    return len(keys) == 1 and not keys[0][1]
+
+def encode_cursor(keys, values):
+    # plain primary key for the default order, opaque token otherwise
+    if is_pk_order(keys):
+        return values[0]
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+def parse_after(keys):
+    raw = request.args.get('after')
+    if raw is None:
+        return None
+    try:
+        values = [int(raw)] if is_pk_order(keys) else json.loads(base64.urlsafe_b64decode(raw.encode()))
+    except ValueError:
+        values = None
+    if isinstance(values, list) and len(values) == len(keys) \
+            and all(cursor_value_fits(column, value) for (column, _), value in zip(keys, values)):
+        return values
+    raise APIException('after must be the cursor returned in next for the same sort')
+
+def cursor_value_fits(column, value):
+    python_type = column.type.python_type
+    if python_type is int:
+        return fits_integer(column, value)
+    # type() and not isinstance(), a bool is an int
+    return type(value) is python_type
+
+def after_condition(keys, values):
+    # (k1, k2, ...) > (v1, v2, ...) spelled out so every key can have its own direction
+    clauses = []
+    for index, (column, descending) in enumerate(keys):
+        equal = [keys[previous][0] == values[previous] for previous in range(index)]
+        clauses.append(and_(*equal, column < values[index] if descending else column > values[index]))
+    return or_(*clauses)
+
+def list_select(model, fields, keys, after):
+    """
+    SELECT of the projected fields followed by the sort keys, filtered and
+    ordered by the request parameters.
+    """
+    stmt = (
+        db.select(*[getattr(model, field) for field in fields], *[column for column, _ in keys])
+        .where(*parse_filters(model), *default_scope(model))
+        .order_by(*[column.desc() if descending else column.asc() for column, descending in keys])
+    )
+    if after is not None:
+        stmt = stmt.where(after_condition(keys, after))
+    return stmt
+
+def page_query(model):
+    """
+    Returns the statement of the requested page and a function turning its
+    rows into the page dicts plus the cursor of the next page.
+    """
+    limit = parse_limit()
+    fields = parse_fields(model)
+    keys = parse_sort(model)
+    stmt = list_select(model, fields, keys, parse_after(keys)).limit(limit + 1)
+    serialize = row_serializer(model, fields)
+
+    def page(rows):
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(keys, rows[-1][len(fields):])
+        return [serialize(row) for row in rows], next_cursor
+
+    return stmt, page
+
+def keyset_page(model):
+    """
+    Returns one page of `model` rows as dicts plus the cursor of the next page,
+    selecting only the requested columns instead of loading ORM instances.
+    """
+    stmt, page = page_query(model)
+    return page(db.session.execute(stmt).all())
+
+def wants_stream():
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+def stream_rows(model):
+    """
+    Streams every matching row after the cursor as NDJSON. Rows are fetched in
+    batches through a server side cursor, so memory does not grow with the table.
+    """
+    fields = parse_fields(model)
+    keys = parse_sort(model)
+    stmt = list_select(model, fields, keys, parse_after(keys))
+    if 'limit' in request.args:
+        stmt = stmt.limit(parse_limit())
+
+    serialize = row_serializer(model, fields)
+    dumps = current_app.json.dumps
+
+    def generate():
+        result = db.session.execute(stmt.execution_options(yield_per=STREAM_BATCH))
+        for rows in result.partitions():
+            yield ''.join(dumps(serialize(row)) + '\n' for row in rows)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def list_etag_select(model):
+    # separate scalar subqueries so max() on the indexed columns is a single index probe
+    return db.select(
+        db.select(func.count()).select_from(model).where(*default_scope(model)).scalar_subquery(),
+        db.select(func.max(model.updated_at)).where(*default_scope(model)).scalar_subquery(),
+        db.select(func.max(primary_key(model))).where(*default_scope(model)).scalar_subquery()
+    )
+
+def list_etag_for(model, validators):
+    count, last_update, last_pk = validators
+    return etag_for(model.__tablename__, count, last_update, last_pk, request.query_string)
+
+def list_etag(model):
+    """
+    Strong validator for a list response computed from a single aggregate
+    query, so unchanged lists are answered without loading any row.
+    """
+    return list_etag_for(model, db.session.execute(list_etag_select(model)).one())
@@ -0,0 +1,147 @@
+"""
+Per-route request metrics: latency, SQL statement count and time, and payload
+size. They are exposed in the Prometheus text format on /metrics and, for each
+response, in a Server-Timing header.
+
+Counters are kept per worker process, and /metrics answers with the numbers
+of whichever worker got the scrape. Every series carries that worker's pid
+label, so a scraper sees one series per worker and sums them across pids; a
+restarted worker starts new series from zero.
+
+SLOW_QUERY_MS logs every statement slower than the threshold and
+SLOW_QUERY_COUNT logs every request that runs more statements than the
+threshold, which is how N+1 query patterns show up.
+"""
+import logging
+import os
+import threading
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from models import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+logger = logging.getLogger('starwars.sql')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.statements = {}
+        self.db_seconds = {}
+        self.payload = {}
+
+    def record(self, route, method, status, seconds, statements, db_seconds, size):
+        with self.lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(route, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.statements.setdefault(route, Histogram(STATEMENT_BUCKETS)).observe(statements)
+            self.db_seconds[route] = self.db_seconds.get(route, 0) + db_seconds
+            if size is not None:
+                self.payload.setdefault(route, Histogram(SIZE_BUCKETS)).observe(size)
+
+    def render(self):
+        pid = os.getpid()
+        lines = [f'# Counters of worker pid {pid} only, sum every pid for the whole server.']
+        with self.lock:
+            lines += ['# HELP http_requests_total Requests by route, method and status.',
+                      '# TYPE http_requests_total counter']
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{pid="{pid}",route="{route}",method="{method}",status="{status}"}} {count}')
+
+            for name, help_text, histograms in (
+                ('http_request_duration_seconds', 'Request latency by route.', self.latency),
+                ('db_statements_per_request', 'SQL statements run per request by route.', self.statements),
+                ('http_response_size_bytes', 'Response payload size by route.', self.payload),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for route, histogram in sorted(histograms.items()):
+                    lines.extend(histogram.lines(name, f'pid="{pid}",route="{route}"'))
+
+            lines += ['# HELP db_duration_seconds_total Time spent in SQL statements by route.',
+                      '# TYPE db_duration_seconds_total counter']
+            for route, seconds in sorted(self.db_seconds.items()):
+                lines.append(f'db_duration_seconds_total{{pid="{pid}",route="{route}"}} {seconds}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_seconds += elapsed
+    threshold = os.getenv('SLOW_QUERY_MS')
+    if threshold is not None and elapsed * 1000 >= float(threshold):
+        route = request.path if has_request_context() else '-'
+        logger.warning('slow query %.1f ms on %s: %s', elapsed * 1000, route, statement)
+
+def start_timer():
+    g.request_start = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0
+
+def record_request(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    size = None if response.is_streamed else response.calculate_content_length()
+    metrics.record(route, request.method, response.status_code, elapsed, g.sql_statements, g.sql_seconds, size)
+
+    threshold = os.getenv('SLOW_QUERY_COUNT')
+    if threshold is not None and g.sql_statements > int(threshold):
+        logger.warning('%d statements on %s %s', g.sql_statements, request.method, request.path)
+
+    response.headers['Server-Timing'] = (
+        f'app;dur={elapsed * 1000:.2f}, db;dur={g.sql_seconds * 1000:.2f};desc="{g.sql_statements} queries"'
+    )
+    return response
+
+def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+def setup_metrics(app):
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
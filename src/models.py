@@ -1,14 +1,43 @@
+from datetime import datetime
+from functools import lru_cache
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session, with_loader_criteria
 
 db = SQLAlchemy()
 
+@lru_cache(maxsize=None)
+def row_serializer(model, fields=None):
+    """
+    Builds, once per model and field list, a function that turns a row tuple
+    selected in `fields` order into the same dict serialize() returns.
+    """
+    fields = fields or model.public_fields
+    items = ', '.join(f'{field!r}: row[{index}]' for index, field in enumerate(fields))
+    namespace = {}
+    exec(f'def serialize_{model.__tablename__}_row(row):\n    return {{{items}}}', namespace)
+    return namespace[f'serialize_{model.__tablename__}_row']
+
 class User(db.Model):
     __tablename__ = 'user'
+    __table_args__ = (
+        # unique among active users only, a deactivated account does not keep its name or email
+        db.Index('uq_user_user_name_active', 'user_name', unique=True,
+                 postgresql_where=db.text('is_active = true'), sqlite_where=db.text('is_active = 1')),
+        db.Index('uq_user_email_active', 'email', unique=True,
+                 postgresql_where=db.text('is_active = true'), sqlite_where=db.text('is_active = 1')),
+    )
+    public_fields = ('id', 'user_name', 'email', 'is_active')
     id = db.Column(db.Integer, primary_key=True)
-    user_name = db.Column(db.String(50), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    user_name = db.Column(db.String(50), unique=False, nullable=False)
+    email = db.Column(db.String(120), unique=False, nullable=False)
+    password = db.Column(db.String(255), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False)
+    deactivated_at = db.Column(db.DateTime, nullable=True, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.func.now())
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # ORM flushes (admin, login) bump it too and fail on a row changed since it was loaded
+    __mapper_args__ = {'version_id_col': version}
     planets_favorites = db.relationship('FavoritePlanets', back_populates='user_relationship')
     characters_favorites = db.relationship('FavoriteCharacters', back_populates='user_relationship')
     vehicles_favorites = db.relationship('FavoriteVehicles', back_populates='user_relationship')
@@ -26,12 +55,22 @@ class User(db.Model):
         }
 class Planet(db.Model):
     __tablename__ = 'planet' 
+    __table_args__ = (
+        db.Index('ix_planet_climate_diameter', 'climate', 'diameter'),
+        db.Index('ix_planet_diameter', 'diameter'),
+        db.Index('ix_planet_favorite_count', 'favorite_count', 'planet_id'),
+    )
+    public_fields = ('planet_id', 'planet_name', 'diameter', 'rotation_period', 'orbital_period', 'climate')
     planet_id = db.Column(db.Integer, primary_key=True)
     planet_name = db.Column(db.String(25), unique=True, nullable=False)   
     diameter = db.Column(db.Integer, unique=False, nullable=False)
     rotation_period = db.Column(db.Integer, unique=False, nullable=False)
     orbital_period = db.Column(db.Integer, unique=False, nullable=False)
     climate = db.Column(db.String(25), unique=False, nullable=False)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.func.now())
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
     favorite_by = db.relationship('FavoritePlanets', back_populates='planet_relationship')
     
 
@@ -48,12 +87,22 @@ class Planet(db.Model):
         }
 class Character(db.Model):
     __tablename__ = 'character'
+    __table_args__ = (
+        db.Index('ix_character_gender_age', 'gender', 'age'),
+        db.Index('ix_character_age', 'age'),
+        db.Index('ix_character_favorite_count', 'favorite_count', 'character_id'),
+    )
+    public_fields = ('character_id', 'character_name', 'skin_color', 'hair_color', 'gender', 'age')
     character_id = db.Column(db.Integer, primary_key=True)
     character_name = db.Column(db.String(25), unique=True, nullable=False)
     skin_color = db.Column(db.String(25), unique=False, nullable=False)
     hair_color = db.Column(db.String(25), unique=False, nullable=False)
     gender = db.Column(db.String(25), unique=False, nullable=False)
     age = db.Column(db.Integer, unique=False, nullable=False)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.func.now())
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
     favorite_by = db.relationship('FavoriteCharacters', back_populates='character_relationship')    
     
     def __repr__(self):
@@ -69,12 +118,22 @@ class Character(db.Model):
         }     
 class Vehicle(db.Model):
     __tablename__ = 'vehicle'  
+    __table_args__ = (
+        db.Index('ix_vehicle_passengers_load_capacity', 'passengers', 'load_capacity'),
+        db.Index('ix_vehicle_load_capacity', 'load_capacity'),
+        db.Index('ix_vehicle_favorite_count', 'favorite_count', 'vehicle_id'),
+    )
+    public_fields = ('vehicle_id', 'vehicle_name', 'passengers', 'load_capacity', 'armament', 'length')
     vehicle_id = db.Column(db.Integer, primary_key=True)
     vehicle_name = db.Column(db.String(25), unique=True, nullable=False)
     passengers = db.Column(db.Integer, unique=False, nullable=False)
     load_capacity = db.Column(db.Integer, unique=False, nullable=False)
     armament = db.Column(db.String(50), unique=False, nullable=False)
     length = db.Column(db.Integer, unique=False, nullable=False)  
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.func.now())
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
     favorite_by = db.relationship('FavoriteVehicles', back_populates='vehicle_relationship') 
 
     def __repr__(self):
@@ -90,6 +149,10 @@ class Vehicle(db.Model):
         }
 class FavoritePlanets(db.Model):
     __tablename__ = 'favorite_planets'
+    __table_args__ = (
+        db.Index('uq_favorite_planets_user_id_planet_id', 'user_id', 'planet_id', unique=True),
+        db.Index('ix_favorite_planets_planet_id', 'planet_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user_relationship = db.relationship('User', back_populates='planets_favorites')
@@ -105,6 +168,10 @@ class FavoritePlanets(db.Model):
         }      
 class FavoriteCharacters(db.Model):
     __tablename__ = 'favorite_characters'  
+    __table_args__ = (
+        db.Index('uq_favorite_characters_user_id_character_id', 'user_id', 'character_id', unique=True),
+        db.Index('ix_favorite_characters_character_id', 'character_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user_relationship = db.relationship('User', back_populates='characters_favorites') 
@@ -121,6 +188,10 @@ class FavoriteCharacters(db.Model):
         }
 class FavoriteVehicles(db.Model):
     __tablename__ = 'favorite_vehicles'
+    __table_args__ = (
+        db.Index('uq_favorite_vehicles_user_id_vehicle_id', 'user_id', 'vehicle_id', unique=True),
+        db.Index('ix_favorite_vehicles_vehicle_id', 'vehicle_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user_relationship = db.relationship('User', back_populates='vehicles_favorites') 
@@ -135,3 +206,77 @@ class FavoriteVehicles(db.Model):
             'vehicle': self.vehicle_relationship.serialize()
 
         }
+
+
+def integer_bounds(column):
+    """Smallest and largest value an integer column holds on every database we run on"""
+    if isinstance(column.type, db.BigInteger):
+        bits = 64
+    elif isinstance(column.type, db.SmallInteger):
+        bits = 16
+    else:
+        bits = 32
+    return -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+def fits_integer(column, value):
+    """Whether value is an int, and not a bool, that the integer column can store"""
+    low, high = integer_bounds(column)
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+
+def default_scope(model):
+    """
+    Criteria that hide soft deleted rows of `model`. ORM selects run by the
+    session get them automatically; statements run on a bare connection and
+    scalar subqueries of a select with no entity in its FROM are not reached
+    by the session hook and must add them explicitly.
+    """
+    if model is User:
+        return (User.is_active == True,)  # noqa: E712
+    return ()
+
+@event.listens_for(Session, 'do_orm_execute')
+def active_users_only(execute_state):
+    """
+    Default scope of every ORM select: deactivated users are left out unless
+    the statement runs with execution_options(include_inactive=True).
+    """
+    if execute_state.is_select and not execute_state.execution_options.get('include_inactive', False):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(User, default_scope(User)[0], include_aliases=True)
+        )
+
+
+class UserArchive(db.Model):
+    __tablename__ = 'user_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    user_name = db.Column(db.String(50), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    deactivated_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'Archived user with username {self.user_name} and id {self.user_id}'
+class FavoritePlanetsArchive(db.Model):
+    __tablename__ = 'favorite_planets_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    favorite_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    planet_id = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+class FavoriteCharactersArchive(db.Model):
+    __tablename__ = 'favorite_characters_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    favorite_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    character_id = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+class FavoriteVehiclesArchive(db.Model):
+    __tablename__ = 'favorite_vehicles_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    favorite_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    vehicle_id = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
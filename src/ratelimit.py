@@ -0,0 +1,260 @@
+"""
+Per-client rate limits and a bound on the expensive requests in flight.
+
+Every API route belongs to a group with its own token bucket per client:
+RATE requests a second on average with bursts of up to BURST. A client is
+its address, or the RATELIMIT_CLIENT_HEADER header (an API key) when it
+sends one; login attempts are also counted per account, whatever address
+they come from. A client out of tokens gets 429 with Retry-After.
+
+The buckets live in RATELIMIT_BACKEND:
+
+    memory  per worker, so the real limit is the number of workers times the rate
+    mmap    shared by the workers of one host through RATELIMIT_MMAP_PATH
+    redis   shared by every host, updated by one Lua script per request on
+            RATELIMIT_REDIS_URL; while the server is down requests are let through
+
+The groups marked expensive also take one of RATELIMIT_MAX_IN_FLIGHT slots
+of the worker while they run. When none is free the request is shed at once
+with 503 and Retry-After, instead of queueing behind the slow ones. The bound
+only matters below the requests a worker can run at once: gunicorn.conf.py
+sets it to all the worker's threads but one, the default 8 is for the
+WSGI_THREADS pool of asgi.py.
+
+    RATELIMIT_ENABLED=0               turn both off
+    RATELIMIT_LIST=10,30              rate and burst of a group
+    RATELIMIT_TRUSTED_PROXIES=1       proxies in front of gunicorn, whose X-Forwarded-For is trusted
+"""
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from flask import g, request, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
+from cache import MmapFile, RedisClient
+from database import env_int, env_bool
+
+GROUPS = {
+    'read': {'rate': 50, 'burst': 100, 'expensive': False},
+    'list': {'rate': 10, 'burst': 30, 'expensive': True},
+    'favorites': {'rate': 10, 'burst': 30, 'expensive': True},
+    'search': {'rate': 20, 'burst': 40, 'expensive': False},
+    'write': {'rate': 10, 'burst': 30, 'expensive': True},
+    'bulk': {'rate': 1, 'burst': 5, 'expensive': True},
+    'login': {'rate': 1, 'burst': 10, 'expensive': False}
+}
+ENDPOINT_GROUPS = {
+    'get_favorites': 'favorites',
+    'search_names': 'search',
+    'login': 'login',
+    'add_bulk': 'bulk',
+    'modified_bulk': 'bulk',
+    'delete_bulk': 'bulk'
+}
+EXEMPT = {'metrics', 'static'}
+
+
+def group_limits():
+    groups = {}
+    for name, spec in GROUPS.items():
+        value = os.getenv(f'RATELIMIT_{name.upper()}')
+        if value:
+            rate, burst = value.split(',')
+            spec = dict(spec, rate=float(rate), burst=float(burst))
+        groups[name] = spec
+    return groups
+
+def take(tokens, updated_at, now, rate, burst):
+    """Refills a bucket for the time since updated_at and takes one token. Returns (allowed, tokens left)"""
+    tokens = min(burst, tokens + max(0, now - updated_at) * rate)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+class MemoryBuckets:
+    """In-process buckets, the least recently used client is dropped past max_clients."""
+
+    def __init__(self, max_clients=100000):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            allowed, tokens = take(tokens, updated_at, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+
+class MmapBuckets(MmapFile):
+    """
+    Buckets shared by the workers of one host: fixed slots of (key hash,
+    tokens, updated_at) in a memory mapped file, addressed by key hash with
+    short linear probing and updated under an exclusive flock. When every
+    probed slot is taken the least recently used one is reused, and that
+    client starts again with a full bucket.
+    """
+    SLOT = struct.Struct('<Qdd')
+    PROBES = 4
+
+    def __init__(self, path, slots=65536):
+        self.slots = slots
+        super().__init__(path, slots * self.SLOT.size)
+
+    def take(self, key, rate, burst):
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._locked('write'):
+            target, tokens, updated_at = None, burst, now
+            oldest = None
+            for probe in range(self.PROBES):
+                offset = ((key_hash + probe) % self.slots) * self.SLOT.size
+                slot_hash, slot_tokens, slot_updated_at = self.SLOT.unpack_from(self._map, offset)
+                if slot_hash == key_hash:
+                    target, tokens, updated_at = offset, slot_tokens, slot_updated_at
+                    break
+                if slot_hash == 0 and target is None:
+                    target = offset
+                if oldest is None or slot_updated_at < oldest[1]:
+                    oldest = (offset, slot_updated_at)
+            if target is None:
+                target = oldest[0]
+            allowed, tokens = take(tokens, updated_at, now, rate, burst)
+            self.SLOT.pack_into(self._map, target, key_hash, tokens, now)
+        return allowed, tokens
+
+
+class RedisBuckets(RedisClient):
+    """Buckets shared by every host, each one a hash updated by TAKE_SCRIPT in a single round trip"""
+    # the client sends its clock so the script writes nothing non deterministic;
+    # the bucket expires once it would be full again
+    TAKE_SCRIPT = '''
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+'''
+
+    def take(self, key, rate, burst):
+        reply = self.command('EVAL', self.TAKE_SCRIPT, 1, f'ratelimit:{key}', rate, burst, repr(time.time()))
+        if not isinstance(reply, list):
+            # no server, no limit
+            return True, burst
+        return reply[0] == 1, float(reply[1])
+
+
+def create_buckets():
+    backend = os.getenv('RATELIMIT_BACKEND', 'memory')
+    if backend == 'mmap':
+        return MmapBuckets(os.getenv('RATELIMIT_MMAP_PATH', '/tmp/starwars-ratelimit.mmap'),
+                           slots=env_int('RATELIMIT_MMAP_SLOTS', 65536))
+    if backend == 'redis':
+        return RedisBuckets(os.getenv('RATELIMIT_REDIS_URL', os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')))
+    return MemoryBuckets(max_clients=env_int('RATELIMIT_MAX_CLIENTS', 100000))
+
+
+buckets = create_buckets()
+groups = group_limits()
+in_flight = threading.BoundedSemaphore(env_int('RATELIMIT_MAX_IN_FLIGHT', 8))
+
+
+def group_of(endpoint, method):
+    name = endpoint.rsplit('.', 1)[-1]
+    if name in EXEMPT:
+        return None
+    if name in ENDPOINT_GROUPS:
+        return ENDPOINT_GROUPS[name]
+    if name.startswith('get_all_'):
+        return 'list'
+    return 'read' if method in ('GET', 'HEAD') else 'write'
+
+def client_key():
+    header = os.getenv('RATELIMIT_CLIENT_HEADER')
+    if header and request.headers.get(header):
+        return 'key:' + hashlib.sha1(request.headers[header].encode()).hexdigest()
+    return f'ip:{request.remote_addr}'
+
+def bucket_keys(group):
+    keys = [client_key()]
+    if group == 'login':
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            account = body.get('email', body.get('user_name'))
+            if isinstance(account, str):
+                keys.append(f'account:{account.lower()}')
+    return keys
+
+def rejected(status, message, retry_after):
+    response = jsonify({'msg': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def limit_request():
+    # the admin blueprints, CORS preflights and unmatched URLs are not limited
+    if request.endpoint is None or request.method == 'OPTIONS' or request.blueprint not in (None, 'api'):
+        return None
+    group = group_of(request.endpoint, request.method)
+    if group is None:
+        return None
+    spec = groups[group]
+    for key in bucket_keys(group):
+        allowed, tokens = buckets.take(f'{group}:{key}', spec['rate'], spec['burst'])
+        if not allowed:
+            retry_after = (1 - tokens) / spec['rate']
+            return rejected(429, f'Too many requests, try again in {max(1, math.ceil(retry_after))} seconds', retry_after)
+    if spec['expensive']:
+        if not in_flight.acquire(blocking=False):
+            return rejected(503, 'The server is busy, try again later', 1)
+        g.holds_slot = True
+    return None
+
+def release_slot(exception):
+    if g.pop('holds_slot', False):
+        in_flight.release()
+
+def after_fork():
+    global in_flight
+    buckets.after_fork()
+    # a slot held by another thread of the parent is never released in the child
+    in_flight = threading.BoundedSemaphore(env_int('RATELIMIT_MAX_IN_FLIGHT', 8))
+
+def trusted_proxies(app):
+    return env_int('RATELIMIT_TRUSTED_PROXIES', 0) if app.config['RATELIMIT_ENABLED'] else 0
+
+def proxied_environ(app, environ):
+    """The environ as the WSGI app sees it, with REMOTE_ADDR taken from the trusted X-Forwarded-For hop"""
+    proxies = trusted_proxies(app)
+    if not proxies:
+        return environ
+    return ProxyFix(lambda environ, start_response: environ, x_for=proxies)(environ, None)
+
+def setup_ratelimit(app):
+    app.config.setdefault('RATELIMIT_ENABLED', env_bool('RATELIMIT_ENABLED', True))
+    if not app.config['RATELIMIT_ENABLED']:
+        return
+    proxies = trusted_proxies(app)
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+    app.before_request(limit_request)
+    app.teardown_request(release_slot)
@@ -0,0 +1,233 @@
+"""
+Prefix search over planet, character and vehicle names.
+
+The default backend is a sorted in-memory index built from the database on the
+first search and kept in sync by the write handlers of this process. At most
+once every SEARCH_REBUILD_INTERVAL seconds a background thread catches up with
+the changes of the other workers, while searches keep reading the current
+index. With a shared cache backend (mmap or redis) writes bump a generation
+counter there, and the index is rebuilt when another worker moved it. With the
+per-process backend the rows updated since the last look are read from the
+updated_at index and applied like this worker's own writes; only when the row
+count of a table no longer matches the index (another worker deleted rows) is
+it rebuilt. SEARCH_BACKEND=sql answers every search with index range scans on
+the unique name columns instead.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from cache import catalog_cache
+from models import db, Planet, Character, Vehicle
+
+SEARCHABLE = {
+    'planet': (Planet, 'planet_id', 'planet_name'),
+    'character': (Character, 'character_id', 'character_name'),
+    'vehicle': (Vehicle, 'vehicle_id', 'vehicle_name')
+}
+GENERATION_KEY = 'version:search'
+
+
+class PrefixIndex:
+    def __init__(self):
+        # parallel sorted lists: lowercased keys and the (type, id, name) they point to
+        self._keys = []
+        self._refs = []
+        self._names = {}
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def count(self, kind):
+        return self._counts[kind]
+
+    def build(self, entries):
+        entries = sorted((name.lower(), kind, entity_id, name) for kind, entity_id, name in entries)
+        with self._lock:
+            self._keys = [entry[0] for entry in entries]
+            self._refs = [entry[1:] for entry in entries]
+            self._names = {(kind, entity_id): name for _, kind, entity_id, name in entries}
+            self._counts = Counter(kind for kind, _ in self._names)
+
+    def _position(self, kind, entity_id, name):
+        key = name.lower()
+        index = bisect_left(self._keys, key)
+        while index < len(self._keys) and self._keys[index] == key:
+            if self._refs[index][:2] == (kind, entity_id):
+                return index
+            index += 1
+        return None
+
+    def remove(self, kind, entity_id):
+        with self._lock:
+            name = self._names.pop((kind, entity_id), None)
+            if name is None:
+                return
+            self._counts[kind] -= 1
+            index = self._position(kind, entity_id, name)
+            if index is not None:
+                del self._keys[index]
+                del self._refs[index]
+
+    def add(self, kind, entity_id, name):
+        self.remove(kind, entity_id)
+        key = name.lower()
+        with self._lock:
+            index = bisect_left(self._keys, key)
+            self._keys.insert(index, key)
+            self._refs.insert(index, (kind, entity_id, name))
+            self._names[(kind, entity_id)] = name
+            self._counts[kind] += 1
+
+    def search(self, prefix, kinds, limit):
+        prefix = prefix.lower()
+        results = []
+        with self._lock:
+            index = bisect_left(self._keys, prefix)
+            while index < len(self._keys) and len(results) < limit and self._keys[index].startswith(prefix):
+                kind, entity_id, name = self._refs[index]
+                if kind in kinds:
+                    results.append({'type': kind, 'id': entity_id, 'name': name})
+                index += 1
+        return results
+
+
+class MemorySearch:
+    def __init__(self, rebuild_interval):
+        self.index = PrefixIndex()
+        self.rebuild_interval = rebuild_interval
+        self.built = False
+        # the shared generation counter, or the latest updated_at seen with the per-process backend
+        self.generation = None
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    def _latest_update(self):
+        return max(
+            db.session.execute(db.select(db.func.max(model.updated_at))).scalar() or datetime.min
+            for model, _, _ in SEARCHABLE.values()
+        )
+
+    def _load(self):
+        """Builds the index from every row, under self._lock"""
+        generation = catalog_cache.version(GENERATION_KEY) if catalog_cache.shared else self._latest_update()
+        entries = []
+        for kind, (model, pk, name) in SEARCHABLE.items():
+            rows = db.session.execute(db.select(getattr(model, pk), getattr(model, name)))
+            entries.extend((kind, entity_id, entity_name) for entity_id, entity_name in rows)
+        self.index.build(entries)
+        # only once built, a failed load must leave the index stale
+        self.generation = generation
+        self.built = True
+        self.checked_at = time.monotonic()
+
+    def _catch_up(self):
+        """Applies the names written by other workers since the last look, under self._lock"""
+        if catalog_cache.shared:
+            if catalog_cache.version(GENERATION_KEY) != self.generation:
+                self._load()
+            return
+        # updated_at comes from the clock of the writer when it flushed, older than its commit
+        margin = timedelta(seconds=self.rebuild_interval)
+        since = max(self.generation, datetime.min + margin) - margin
+        latest = self.generation
+        for kind, (model, pk, name) in SEARCHABLE.items():
+            rows = db.session.execute(
+                db.select(getattr(model, pk), getattr(model, name), model.updated_at).where(model.updated_at >= since)
+            )
+            for entity_id, entity_name, updated_at in rows:
+                self.index.add(kind, entity_id, entity_name)
+                latest = max(latest, updated_at)
+            if db.session.execute(db.select(db.func.count()).select_from(model)).scalar() != self.index.count(kind):
+                self._load()
+                return
+        self.generation = latest
+
+    def _refresh(self, app):
+        try:
+            with app.app_context():
+                self._catch_up()
+        except Exception:
+            app.logger.exception('search index not refreshed')
+        finally:
+            self.checked_at = time.monotonic()
+            self._lock.release()
+
+    def ensure_fresh(self):
+        if not self.built:
+            with self._lock:
+                if not self.built:
+                    self._load()
+        elif time.monotonic() - self.checked_at > self.rebuild_interval and self._lock.acquire(blocking=False):
+            # off the request path; the thread releases the lock once done
+            threading.Thread(target=self._refresh, args=(current_app._get_current_object(),), daemon=True).start()
+
+    def search(self, prefix, kinds, limit):
+        self.ensure_fresh()
+        return self.index.search(prefix, kinds, limit)
+
+    def _changed(self):
+        if not catalog_cache.shared:
+            return
+        # stay current only if no other worker changed the catalog since our last look
+        generation = catalog_cache.bump(GENERATION_KEY)
+        if self.generation is not None and generation == self.generation + 1:
+            self.generation = generation
+
+    def indexed(self, kind, entity_id, name):
+        if self.built:
+            self.index.add(kind, entity_id, name)
+        self._changed()
+
+    def removed(self, kind, entity_id):
+        if self.built:
+            self.index.remove(kind, entity_id)
+        self._changed()
+
+    def after_fork(self):
+        # a refresh running in the master when it forked never releases the lock in the child
+        self._lock = threading.Lock()
+
+
+class SqlSearch:
+    """Range scans on the unique name indexes, case sensitive"""
+
+    def ensure_fresh(self):
+        pass
+
+    def after_fork(self):
+        pass
+
+    def search(self, prefix, kinds, limit):
+        results = []
+        for kind in kinds:
+            model, pk, name = SEARCHABLE[kind]
+            column = getattr(model, name)
+            stmt = db.select(getattr(model, pk), column).where(column >= prefix, column < prefix + '\uffff')
+            for entity_id, entity_name in db.session.execute(stmt.order_by(column).limit(limit)):
+                results.append({'type': kind, 'id': entity_id, 'name': entity_name})
+        return sorted(results, key=lambda result: result['name'])[:limit]
+
+    def indexed(self, kind, entity_id, name):
+        pass
+
+    def removed(self, kind, entity_id):
+        pass
+
+
+if os.getenv('SEARCH_BACKEND', 'memory') == 'sql':
+    search_backend = SqlSearch()
+else:
+    search_backend = MemorySearch(float(os.getenv('SEARCH_REBUILD_INTERVAL', 30)))
+
+
+def index_name(kind, entity_id, name):
+    search_backend.indexed(kind, entity_id, name)
+
+def unindex_name(kind, entity_id):
+    search_backend.removed(kind, entity_id)
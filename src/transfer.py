@@ -0,0 +1,237 @@
+"""
+Streaming import and export of the catalog as NDJSON or CSV files, driven by
+the `flask catalog` commands.
+
+Files are read and written one chunk at a time, so memory does not depend on
+their size. Every imported chunk is a transaction of its own, written with
+COPY on Postgres (psycopg2) and a single executemany elsewhere, and followed
+by a checkpoint next to the file with the byte offset reached. When a chunk
+fails nothing of it is kept, and the next run with resume picks up at the
+start of that chunk.
+"""
+import csv
+import io
+import json
+import os
+import time
+from sqlalchemy import insert
+from resources import RESOURCES, coercer
+from cache import catalog_cache
+from leaderboard import counts_reconciled
+from models import db, row_serializer
+from search import GENERATION_KEY
+
+FORMATS = ('ndjson', 'csv')
+CHUNK = 10000
+
+
+class TransferError(Exception):
+    pass
+
+
+def file_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+def checkpoint_path(path):
+    return path + '.checkpoint'
+
+def read_checkpoint(path, kind):
+    try:
+        with open(checkpoint_path(path)) as handle:
+            checkpoint = json.load(handle)
+    except FileNotFoundError:
+        return None
+    if checkpoint['kind'] != kind:
+        raise TransferError(f'{checkpoint_path(path)} belongs to an import of {checkpoint["kind"]}s')
+    return checkpoint
+
+def write_checkpoint(path, checkpoint):
+    # written aside and renamed, a crash never leaves half a checkpoint
+    partial = checkpoint_path(path) + '.tmp'
+    with open(partial, 'w') as handle:
+        json.dump(checkpoint, handle)
+    os.replace(partial, checkpoint_path(path))
+
+
+class Lines:
+    """Decoded lines of a binary file, keeping the byte offset after the last one handed out"""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.offset = handle.tell()
+
+    def __iter__(self):
+        for line in self.handle:
+            self.offset += len(line)
+            yield line.decode('utf-8')
+
+def ndjson_records(handle, offset):
+    handle.seek(offset)
+    lines = Lines(handle)
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise TransferError(f'Invalid JSON at byte {lines.offset - len(line.encode())}')
+        yield record, lines.offset
+
+def csv_records(handle, offset):
+    header = next(csv.reader([handle.readline().decode('utf-8')]), None)
+    if not header:
+        return
+    if offset:
+        handle.seek(offset)
+    lines = Lines(handle)
+    for row in csv.reader(lines):
+        if row:
+            yield dict(zip(header, row)), lines.offset
+
+READERS = {'ndjson': ndjson_records, 'csv': csv_records}
+
+
+def validate(spec, columns, convert, record, row_number):
+    if not isinstance(record, dict):
+        raise TransferError(f'Row {row_number}: every row must be an object')
+    if len(record) != len(columns) or any(column not in record for column in columns):
+        missing = [field for field in spec['fields'] if field not in record]
+        raise TransferError(f'Row {row_number}: {spec["required_msg"] if missing else spec["allowed_msg"]}')
+    row = {}
+    for column in columns:
+        try:
+            row[column] = convert[column](record[column])
+        except ValueError as error:
+            raise TransferError(f'Row {row_number}: {error}')
+    return row
+
+
+def copy_rows(model, columns, rows):
+    """COPY of one chunk through the psycopg2 connection of the session"""
+    preparer = db.session.get_bind().dialect.identifier_preparer
+    table = preparer.format_table(model.__table__)
+    names = ', '.join(preparer.quote(column) for column in columns)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'COPY {table} ({names}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+def write_rows(model, columns, rows):
+    bind = db.session.get_bind()
+    if bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2':
+        copy_rows(model, columns, rows)
+    else:
+        db.session.execute(insert(model), rows)
+
+def import_file(kind, path, fmt=None, chunk=CHUNK, resume=False, progress=None):
+    """
+    Inserts every row of `path` into the `kind` table. Returns the number of
+    rows imported by this run; raises TransferError on the first bad chunk.
+    """
+    spec = RESOURCES[kind]
+    model = spec['model']
+    pk = model.__mapper__.primary_key[0].key
+    fmt = file_format(path, fmt)
+    checkpoint = read_checkpoint(path, kind) if resume else None
+    if checkpoint is None:
+        checkpoint = {'kind': kind, 'format': fmt, 'offset': 0, 'rows': 0, 'with_ids': None}
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    imported = 0
+
+    def flush(rows, offset):
+        nonlocal imported
+        columns = list(rows[0])
+        try:
+            write_rows(model, columns, rows)
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            raise TransferError(
+                f'Rows {checkpoint["rows"] + 1} to {checkpoint["rows"] + len(rows)} failed, nothing of them was imported: '
+                f'{getattr(error, "orig", error)}. {checkpoint["rows"]} rows are in, run again with --resume to continue'
+            )
+        imported += len(rows)
+        checkpoint.update(offset=offset, rows=checkpoint['rows'] + len(rows))
+        write_checkpoint(path, checkpoint)
+        if progress:
+            progress(checkpoint['rows'], offset / size if size else 1, imported / (time.perf_counter() - start))
+
+    with open(path, 'rb') as handle:
+        rows = []
+        columns = convert = None
+        for record, offset in READERS[fmt](handle, checkpoint['offset']):
+            row_number = checkpoint['rows'] + len(rows) + 1
+            if columns is None:
+                # ids are kept when the file has them, in every row or in none
+                if checkpoint['with_ids'] is None:
+                    checkpoint['with_ids'] = isinstance(record, dict) and pk in record
+                columns = ([pk] if checkpoint['with_ids'] else []) + list(spec['fields'])
+                # the coercers of the HTTP routes, which also turn the digit strings of CSV files into integers
+                convert = dict(spec['coercers'], **{pk: coercer(pk, model.__table__.c[pk])})
+            rows.append(validate(spec, columns, convert, record, row_number))
+            if len(rows) == chunk:
+                flush(rows, offset)
+                rows = []
+        if rows:
+            flush(rows, offset)
+
+    finished(kind, model, checkpoint['with_ids'])
+    if os.path.exists(checkpoint_path(path)):
+        os.remove(checkpoint_path(path))
+    return imported
+
+def finished(kind, model, with_ids):
+    """Makes the rest of the app see the imported rows"""
+    bind = db.session.get_bind()
+    table = model.__tablename__
+    if bind.dialect.name == 'postgresql':
+        if with_ids:
+            pk = model.__mapper__.primary_key[0].key
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', '{pk}'), (SELECT max(\"{pk}\") FROM \"{table}\"))"
+            ))
+        db.session.execute(db.text(f'ANALYZE "{table}"'))
+    elif bind.dialect.name == 'sqlite':
+        db.session.execute(db.text(f'ANALYZE "{table}"'))
+    db.session.commit()
+    catalog_cache.bump(GENERATION_KEY)
+    counts_reconciled(kind)
+
+
+def export_file(kind, path, fmt=None, chunk=CHUNK, progress=None):
+    """
+    Writes every `kind` row, ordered by id, to `path` in the import format.
+    Rows are fetched through a server side cursor; returns how many.
+    """
+    model = RESOURCES[kind]['model']
+    fields = model.public_fields
+    pk = model.__mapper__.primary_key[0]
+    fmt = file_format(path, fmt)
+    total = db.session.execute(db.select(db.func.count()).select_from(model)).scalar()
+    serialize = row_serializer(model)
+    stmt = db.select(*[getattr(model, field) for field in fields]).order_by(pk).execution_options(yield_per=chunk)
+    start = time.perf_counter()
+    exported = 0
+
+    # written aside and renamed, so an interrupted export never looks complete
+    partial = path + '.part'
+    with open(partial, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.writer(handle) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(fields)
+        for rows in db.session.execute(stmt).partitions():
+            if writer:
+                writer.writerows(rows)
+            else:
+                handle.write(''.join(json.dumps(serialize(row), separators=(',', ':')) + '\n' for row in rows))
+            exported += len(rows)
+            if progress:
+                progress(exported, exported / total if total else 1, exported / (time.perf_counter() - start))
+    os.replace(partial, path)
+    return exported
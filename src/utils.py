@@ -1,4 +1,5 @@
-from flask import jsonify, url_for
+import hashlib
+from flask import jsonify, url_for, request, make_response
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +16,50 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def etag_for(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def version_etag(kind, entity_id, version):
+    """Strong ETag of a single row, which expected_version() reads back from If-Match"""
+    return f'{kind}-{entity_id}-{version}'
+
+def expected_version(kind, entity_id):
+    """
+    Row version required by the If-Match header: None when there is no
+    precondition, 0 (no row has it) when no tag names this entity.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    prefix = f'{kind}-{entity_id}-'
+    for tag in request.if_match.as_set():
+        if tag.startswith(prefix) and tag[len(prefix):].isdigit():
+            return int(tag[len(prefix):])
+    return 0
+
+def is_not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    return (last_modified is not None and request.if_modified_since is not None
+            and last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None))
+
+def conditional_response(etag, build, last_modified=None):
+    """
+    Answers 304 when the request validators match, otherwise calls `build`
+    for the full response. Either way the validators are sent back.
+    """
+    response = make_response('', 304) if is_not_modified(etag, last_modified) else make_response(build())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if 'admin' in app.blueprints else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -1,7 +1,12 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
+#
+# The settings, including preload_app, are in gunicorn.conf.py.
 
-from app import app as application
+from app import create_app, warm_up
+
+application = create_app()
+warm_up(application)
 
 if __name__ == "__main__":
     application.run()